@@ -0,0 +1,103 @@
+# Compare the SQLite and DuckDB query backends on the same logical queries: the Explorer reads at every frequency,
+# the Key Insights yearly totals and the NB02 city averages. Runs on the full dataset and on a scaled up copy of it,
+# checks both backends give the same answers and writes the timings as JSON.
+#
+# Usage (from the repository root):
+#   python benchmarks/backend_comparison.py --scale 10 --output benchmarks/results/backend_comparison.json
+
+# import necessary libraries
+import os
+import sys
+import json
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Make the modules in the notebooks folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'notebooks'))
+import weather_db as wdb
+import weather_store as ws
+import data_access as da
+import synthetic
+from memory_profile import scale_up, load_dataset
+from run_benchmarks import measure
+
+perception_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'perception_data.csv')
+
+# The logical queries to compare, as functions of the engine (which the DuckDB backend ignores)
+def queries(cities, start, end):
+    some_cities = cities[:5]
+    return {
+        'explorer_daily': lambda engine: da.read_weather_cities(engine, some_cities, start, end, wdb.weather_variables, 'Daily'),
+        'explorer_monthly': lambda engine: da.read_weather_cities(engine, some_cities, start, end, wdb.weather_variables, 'Monthly'),
+        'explorer_yearly': lambda engine: da.read_weather_cities(engine, some_cities, start, end, wdb.weather_variables, 'Yearly'),
+        'explorer_5_yearly': lambda engine: da.read_weather_cities(engine, some_cities, start, end, wdb.weather_variables, '5 Yearly'),
+        'yearly_totals': lambda engine: da.fetch_yearly(['precipitation_hours', 'precipitation_sum'], engine=engine),
+        'city_averages': lambda engine: da.fetch_city_averages(['precipitation_sum', 'precipitation_hours'], engine=engine),
+    }
+
+# Largest difference between the numbers two backends returned. The store keeps float32 values, so small differences are expected.
+def max_difference(a, b):
+    a = a.select_dtypes('number').to_numpy(dtype='float64')
+    b = b.select_dtypes('number').to_numpy(dtype='float64')
+    if a.shape != b.shape:
+        return float('inf')
+    return float(np.nanmax(np.abs(a - b), initial=0))
+
+# Time every query on both backends for one dataset
+def compare_backends(df, label, repeats, warmup, work_dir):
+    store_path = os.path.join(work_dir, 'weather')
+    db_path = os.path.join(work_dir, 'rainy.db')
+    if os.path.exists(perception_csv):
+        perception = perception_csv
+    else:
+        perception = os.path.join(work_dir, 'perception_data.csv')
+        synthetic.synthetic_perception().to_csv(perception, index=False)
+
+    ws.write_weather_store(df, store_path)
+    wdb.build_database(db_path, store_path, perception).dispose()
+    dates = pd.to_datetime(df['date'])
+    start, end = dates.min().date(), dates.max().date()
+    cities = ws.list_cities(store_path)
+
+    engine = da.get_engine(db_path)
+    da.store_path = store_path
+    results = []
+    for name, query in queries(cities, start, end).items():
+        answers = {}
+        for backend in ['sqlite', 'duckdb']:
+            da.backend = backend
+            da.clear_cache()
+            answers[backend] = query(engine)
+            result = {'dataset': label, 'rows': len(df), 'query': name, 'backend': backend}
+            result.update(measure(lambda: query(engine), repeats, warmup, setup=da.clear_cache))
+            results.append(result)
+            print(f"{label:<16}{name:<20}{backend:<8}{result['median_s']:>12.4f}{result['peak_mb']:>12.1f}")
+        difference = max_difference(answers['sqlite'], answers['duckdb'])
+        results[-1]['max_difference'] = results[-2]['max_difference'] = difference
+    engine.dispose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the SQLite and DuckDB query backends')
+    parser.add_argument('--scale', type=int, default=10, help='how many copies of the full dataset to use for the scaled up run')
+    parser.add_argument('--repeats', type=int, default=5, help='timed runs of each query')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs of each query before the timed ones')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    df, label = load_dataset()
+    print(f"{'dataset':<16}{'query':<20}{'backend':<8}{'median s':>12}{'peak MB':>12}")
+    results = []
+    for dataset, dataset_label in [(df, label), (scale_up(df, args.scale), f'{label} x{args.scale}')]:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results.extend(compare_backends(dataset, dataset_label, args.repeats, args.warmup, work_dir))
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
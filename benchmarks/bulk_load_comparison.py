@@ -0,0 +1,100 @@
+# Compare building rainy.db with the bulk loader (bulk_load.py) against the DataFrame.to_sql recipe it replaced,
+# on the full dataset and on a scaled up copy of it. Reports the weather rows loaded per second by each and the
+# total time including the rollup tables, and writes the timings as JSON.
+#
+# Usage (from the repository root):
+#   python benchmarks/bulk_load_comparison.py --scale 10 --output benchmarks/results/bulk_load_comparison.json
+
+# import necessary libraries
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+# Make the modules in the notebooks folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'notebooks'))
+import weather_db as wdb
+import weather_store as ws
+import bulk_load
+import synthetic
+from memory_profile import scale_up, load_dataset
+from backend_comparison import perception_csv
+
+# How rainy.db used to be built: validated dataframes appended with to_sql, then the rollups and a VACUUM
+def to_sql_load(db_path, weather_source, perception):
+    start = time.perf_counter()
+    engine = create_engine(f'sqlite:///{db_path}', echo=False)
+    wdb.create_schema(engine)
+    weather_rows = 0
+    for df in wdb.iter_weather_source(weather_source):
+        wdb.load_weather(df, engine)
+        weather_rows += len(df)
+    wdb.load_perception(pd.read_csv(perception), engine)
+    load_seconds = time.perf_counter() - start
+
+    wdb.build_rollups(engine)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM;"))
+    engine.dispose()
+    seconds = time.perf_counter() - start
+    return {
+        'weather_rows': weather_rows,
+        'load_s': round(load_seconds, 3),
+        'total_s': round(seconds, 3),
+        'rows_per_s': round(weather_rows / load_seconds),
+    }
+
+loaders = {
+    'to_sql': to_sql_load,
+    'bulk_load': bulk_load.bulk_load,
+}
+
+# Build the database with every loader, `repeats` times each, keeping the fastest run
+def compare_loaders(df, label, repeats, work_dir):
+    store_path = os.path.join(work_dir, 'weather')
+    if os.path.exists(perception_csv):
+        perception = perception_csv
+    else:
+        perception = os.path.join(work_dir, 'perception_data.csv')
+        synthetic.synthetic_perception().to_csv(perception, index=False)
+    ws.write_weather_store(df, store_path)
+
+    results = []
+    for name, loader in loaders.items():
+        runs = []
+        for i in range(repeats):
+            db_path = os.path.join(work_dir, f'{name}_{i}.db')
+            runs.append(loader(db_path, store_path, perception))
+            os.remove(db_path)
+        best = min(runs, key=lambda run: run['total_s'])
+        result = {'dataset': label, 'loader': name, 'weather_rows': best['weather_rows'], 'load_s': best['load_s'],
+                  'total_s': best['total_s'], 'rows_per_s': best['rows_per_s']}
+        results.append(result)
+        print(f"{label:<16}{name:<12}{result['weather_rows']:>12}{result['load_s']:>10.2f}{result['total_s']:>10.2f}{result['rows_per_s']:>12}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare building rainy.db with the bulk loader and with to_sql')
+    parser.add_argument('--scale', type=int, default=10, help='how many copies of the full dataset to use for the scaled up run')
+    parser.add_argument('--repeats', type=int, default=3, help='builds with each loader, keeping the fastest')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    df, label = load_dataset()
+    print(f"{'dataset':<16}{'loader':<12}{'rows':>12}{'load s':>10}{'total s':>10}{'rows/s':>12}")
+    results = []
+    for dataset, dataset_label in [(df, label), (scale_up(df, args.scale), f'{label} x{args.scale}')]:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results.extend(compare_loaders(dataset, dataset_label, args.repeats, work_dir))
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# Load test the website pages without a browser. Each simulated user gets its own Streamlit AppTest session, which
+# runs the page script in this process the same way the Streamlit server does, so every session shares the same
+# database engine and caches as real users would. Sessions run in parallel and keep changing the widgets at random.
+# Reports the p50/p95/p99 rerun latency of each page, how much of it was spent in the database and how much in
+# drawing the page, and how much the memory of the process grew for each session.
+#
+# Usage (from the repository root, with data/rainy.db built):
+#   python benchmarks/load_test.py --sessions 50 --concurrency 8 --reruns 10 --output benchmarks/results/load_test.json
+
+# import necessary libraries
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import resource
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+# The pages are run from the repository root, like `streamlit run docs/Home.py`
+root_path = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(root_path, 'notebooks'))
+import data_access as da
+
+pages = {
+    'visualiser': os.path.join(root_path, 'docs', 'pages', '2_Data_Visualiser.py'),
+    'key_insights': os.path.join(root_path, 'docs', 'pages', '3_Key_Insights.py'),
+}
+
+# Session state entry the database time of each rerun is added up in
+_db_seconds = '_load_test_db_seconds'
+
+# Wrap data_access.read_sql so the time every query takes (including cache hits) is added to the session state of the
+# session that ran it. Every query on the pages goes through read_sql, so this splits each rerun into database time
+# and everything else.
+def _instrument_read_sql():
+    read_sql = da.read_sql
+
+    def timed_read_sql(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return read_sql(*args, **kwargs)
+        finally:
+            st.session_state[_db_seconds] = st.session_state.get(_db_seconds, 0) + time.perf_counter() - start
+
+    da.read_sql = timed_read_sql
+
+# Resident memory of this process in megabytes
+def rss_mb():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (OSError, ValueError):
+        # Peak rather than current memory, but the best we can do off Linux (kilobytes on Linux, bytes on macOS)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 1024**2 if sys.platform == 'darwin' else maxrss / 1024
+
+# Find a widget by its label and key (widgets created without a key have a key of None)
+def _widget(widgets, label, key=None):
+    for widget in widgets:
+        if widget.label == label and widget.key == key:
+            return widget
+    raise KeyError(f"No widget labelled {label!r} with key {key!r}")
+
+# A random start and end date inside the range the pages allow
+def _random_range(rng):
+    first, last = datetime.date(1940, 1, 1), datetime.date(2023, 12, 31)
+    start = first + datetime.timedelta(days=rng.randrange((last - first).days - 1))
+    end = start + datetime.timedelta(days=rng.randrange(1, (last - start).days + 1))
+    return start, end
+
+# Pick random selections for every widget on the Visualiser page, both in the Explorer and the Visualiser tabs
+def randomise_visualiser(at, rng):
+    cities = _widget(at.multiselect, 'Cities').options
+    frequencies = ['5 Yearly', 'Yearly', 'Monthly', 'Daily']
+
+    start, end = _random_range(rng)
+    _widget(at.multiselect, 'Cities').set_value(rng.sample(cities, rng.randint(1, min(5, len(cities)))))
+    _widget(at.selectbox, 'Frequency').set_value(rng.choice(frequencies))
+    _widget(at.date_input, 'Start date').set_value(start)
+    _widget(at.date_input, 'End date').set_value(end)
+    indicators = _widget(at.multiselect, 'Indicators')
+    indicators.set_value(rng.sample(indicators.options, rng.randint(1, len(indicators.options))))
+    _widget(at.radio, 'Table layout').set_value(rng.choice(['Long', 'Wide']))
+
+    start, end = _random_range(rng)
+    _widget(at.multiselect, 'Cities', 'dv_cities').set_value(rng.sample(cities, rng.randint(1, min(5, len(cities)))))
+    _widget(at.selectbox, 'Frequency', 'dv_freq').set_value(rng.choice(frequencies))
+    _widget(at.date_input, 'Start date', 'dv_start').set_value(start)
+    _widget(at.date_input, 'End date', 'dv_end').set_value(end)
+    indicator = _widget(at.selectbox, 'Indicators', 'dv_indicator')
+    indicator.set_value(rng.choice(indicator.options))
+    plot_type = _widget(at.selectbox, 'Plot type')
+    plot_type.set_value(rng.choice(plot_type.options))
+
+# The Key Insights charts are interactive in the browser only, so there is nothing to change on the server
+def randomise_key_insights(at, rng):
+    pass
+
+randomisers = {
+    'visualiser': randomise_visualiser,
+    'key_insights': randomise_key_insights,
+}
+
+# Simulate one user: open the page, then change the widgets and rerun it `reruns` times.
+# Returns the timings of every rerun after the first page load.
+def run_session(page, reruns, seed, timeout):
+    rng = random.Random(seed)
+    at = AppTest.from_file(pages[page], default_timeout=timeout)
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"{page} failed to load: {at.exception[0].message}")
+
+    timings = []
+    for _ in range(reruns):
+        randomisers[page](at, rng)
+        at.session_state[_db_seconds] = 0
+        start = time.perf_counter()
+        at.run()
+        total = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(f"{page} failed: {at.exception[0].message}")
+        db = at.session_state[_db_seconds]
+        timings.append({'total_s': total, 'db_s': db, 'render_s': total - db})
+    return timings
+
+def _percentiles(values):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': round(float(p50), 4), 'p95': round(float(p95), 4), 'p99': round(float(p99), 4)}
+
+# Run `sessions` simulated users on a page, `concurrency` at a time, and summarise their rerun timings
+def load_test(page, sessions, concurrency, reruns, seed, timeout):
+    # One session first so imports and the database connections don't count as memory growth
+    run_session(page, 1, seed, timeout)
+    memory_before = rss_mb()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_session, page, reruns, seed + i + 1, timeout) for i in range(sessions)]
+        timings = [timing for future in futures for timing in future.result()]
+    elapsed = time.perf_counter() - start
+    memory_after = rss_mb()
+
+    return {
+        'page': page,
+        'sessions': sessions,
+        'concurrency': concurrency,
+        'reruns': len(timings),
+        'reruns_per_s': round(len(timings) / elapsed, 2),
+        'latency_s': _percentiles([timing['total_s'] for timing in timings]),
+        'db_s': _percentiles([timing['db_s'] for timing in timings]),
+        'render_s': _percentiles([timing['render_s'] for timing in timings]),
+        'db_share_pct': round(100 * sum(timing['db_s'] for timing in timings) / sum(timing['total_s'] for timing in timings), 1),
+        'memory_growth_mb': round(memory_after - memory_before, 1),
+        'memory_per_session_mb': round((memory_after - memory_before) / sessions, 3),
+        'query_cache': da.cache_stats(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the website pages with many simulated users')
+    parser.add_argument('--pages', nargs='+', choices=list(pages), default=list(pages), help='pages to load test')
+    parser.add_argument('--sessions', type=int, default=20, help='simulated users for each page')
+    parser.add_argument('--concurrency', type=int, default=4, help='users running at the same time')
+    parser.add_argument('--reruns', type=int, default=5, help='widget changes each user makes')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds a single rerun may take')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the random widget selections')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    os.chdir(root_path)
+    _instrument_read_sql()
+
+    print(f"{'page':<14}{'reruns':>8}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'db p50':>9}{'render p50':>12}{'MB/session':>12}")
+    results = []
+    for page in args.pages:
+        da.clear_cache()
+        result = load_test(page, args.sessions, args.concurrency, args.reruns, args.seed, args.timeout)
+        results.append(result)
+        latency = result['latency_s']
+        print(f"{page:<14}{result['reruns']:>8}{latency['p50']:>9}{latency['p95']:>9}{latency['p99']:>9}"
+              f"{result['db_s']['p50']:>9}{result['render_s']['p50']:>12}{result['memory_per_session_mb']:>12}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
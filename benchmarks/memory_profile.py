@@ -0,0 +1,91 @@
+# Measure how much memory the weather data takes up in the default layout and in the compact layout,
+# for the full dataset and for a scaled up copy of it.
+#
+# Usage (from the repository root):
+#   python benchmarks/memory_profile.py --scale 10 --output benchmarks/results/memory_profile.json
+#
+# Without a weather store or rainy.db it measures synthetic data for 20 cities instead.
+
+# import necessary libraries
+import os
+import sys
+import json
+import argparse
+import datetime
+import pandas as pd
+
+# Make the modules in the notebooks folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'notebooks'))
+import weather_db as wdb
+import weather_store as ws
+import data_access as da
+import custom_functions as cf
+import synthetic
+
+# Load every row of the weather data along with a label for it: from the columnar store if it has been built,
+# the database otherwise, or synthetic data for 20 cities if neither has been built
+def load_dataset():
+    if ws.list_cities():
+        return ws.read_weather_store(), 'full'
+    if os.path.exists(da.db_path):
+        return pd.read_sql('SELECT * FROM weather', da.get_engine()), 'full'
+    cities = synthetic.synthetic_cities(20)
+    responses = synthetic.synthetic_responses(cities, datetime.date(1940, 1, 1), datetime.date(2023, 12, 31))
+    return cf.process_responses(responses, cities), 'synthetic'
+
+# The layout used everywhere before the compact mode: float64 measurements, city names as Python strings
+# and dates as Python datetime.date objects
+def default_layout(df):
+    df = df.copy()
+    df['city'] = df['city'].astype(str).astype(object)
+    df['date'] = pd.to_datetime(df['date']).dt.date
+    for variable in wdb.weather_variables:
+        df[variable] = df[variable].astype('float64')
+    return df
+
+# Make a bigger synthetic dataset by repeating the data under new city names
+def scale_up(df, factor):
+    copies = [df.assign(city=df['city'].astype(str) + f' {i}') for i in range(factor)]
+    return pd.concat(copies, ignore_index=True)
+
+# Memory of a dataframe in megabytes, including the Python objects stored in it
+def memory_mb(df):
+    return df.memory_usage(index=True, deep=True).sum() / 1024**2
+
+# Measure one dataset in both layouts
+def profile(df, label):
+    default_df = default_layout(df)
+    compact_df = wdb.compact_weather(default_df)
+    default_mb = memory_mb(default_df)
+    compact_mb = memory_mb(compact_df)
+
+    return {
+        'dataset': label,
+        'rows': len(df),
+        'default_mb': round(default_mb, 1),
+        'compact_mb': round(compact_mb, 1),
+        'saving_pct': round(100 * (1 - compact_mb / default_mb), 1),
+        'columns_default_mb': {column: round(size / 1024**2, 2) for column, size in default_df.memory_usage(deep=True).items()},
+        'columns_compact_mb': {column: round(size / 1024**2, 2) for column, size in compact_df.memory_usage(deep=True).items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the memory of the weather data in the default and compact layouts')
+    parser.add_argument('--scale', type=int, default=10, help='how many copies of the full dataset to use for the scaled up run')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    df, label = load_dataset()
+    results = [profile(df, label), profile(scale_up(df, args.scale), f'{label} x{args.scale}')]
+
+    print(f"{'dataset':<16}{'rows':>12}{'default MB':>14}{'compact MB':>14}{'saving':>10}")
+    for result in results:
+        print(f"{result['dataset']:<16}{result['rows']:>12,}{result['default_mb']:>14}{result['compact_mb']:>14}{result['saving_pct']:>9}%")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
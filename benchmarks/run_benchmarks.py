@@ -0,0 +1,227 @@
+# Time each stage of the data pipeline on synthetic data: processing the api responses, building rainy.db,
+# the Explorer query and resample, drawing a Visualiser figure and the Key Insights aggregates.
+# Every stage is run a few times after a warm up run and the minimum, median and spread of the timings are reported,
+# along with the peak memory of one extra run. The results are written as JSON so runs on different commits can be compared.
+#
+# Usage (from the repository root):
+#   python benchmarks/run_benchmarks.py --cities 20 200 2000 --years 20 --output benchmarks/results/daily.json
+#   python benchmarks/run_benchmarks.py --cities 20 --years 5 --resolution hourly
+#   python benchmarks/run_benchmarks.py --cities 20 --compare benchmarks/results/daily.json
+
+# import necessary libraries
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+
+# Make the modules in the notebooks folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'notebooks'))
+import custom_functions as cf
+import weather_db as wdb
+import weather_store as ws
+import data_access as da
+import plot_utils as pu
+import synthetic
+
+# How each variable is combined when hourly data is turned into daily data
+_daily_aggregations = {
+    'temperature_2m_max': 'max',
+    'temperature_2m_min': 'min',
+    'temperature_2m_mean': 'mean',
+    'daylight_duration': 'sum',
+    'sunshine_duration': 'sum',
+    'precipitation_sum': 'sum',
+    'rain_sum': 'sum',
+    'precipitation_hours': 'sum',
+}
+
+# Run `function` `repeats` times after `warmup` untimed runs, with garbage collection paused while it runs so the
+# timings are repeatable. `setup` is called before every run but isn't timed. A last run under tracemalloc measures
+# the peak memory; it is kept separate because tracing slows everything down.
+def measure(function, repeats=5, warmup=1, setup=None):
+    timings = []
+    for i in range(warmup + repeats):
+        if setup:
+            setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if i >= warmup:
+            timings.append(elapsed)
+
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'repeats': repeats,
+        'min_s': round(min(timings), 6),
+        'median_s': round(statistics.median(timings), 6),
+        'mean_s': round(statistics.mean(timings), 6),
+        'stdev_s': round(statistics.stdev(timings), 6) if len(timings) > 1 else 0.0,
+        'peak_mb': round(peak / 1024**2, 2),
+    }
+
+# Turn hourly rows into daily rows the same way the api works out its daily values
+def hourly_to_daily(df):
+    days = df['date'].dt.floor('D').rename('date')
+    aggregations = {variable: _daily_aggregations.get(variable, 'mean') for variable in wdb.weather_variables}
+    return df.groupby([days, 'city'], observed=True).agg(aggregations).reset_index()
+
+# Draw one Visualiser figure the way the page does, without the figure cache
+def draw_figure(engine, city, start, end, variable, frequency):
+    from plotnine import ggplot, aes, geom_line, labs, theme_minimal, theme, element_text, element_line
+
+    df = da.read_weather(engine, city, start, end, [variable], frequency)
+    df.insert(0, 'city', city)
+    figure_size = (10, 6)
+    df = pu.downsample(df, variable, figure_width=figure_size[0])
+    g = (
+        ggplot(df, aes(x=df.index, y=variable, color=variable, fill=variable)) +
+        geom_line() +
+        labs(x='Date', y=variable) +
+        theme_minimal() +
+        theme(text=element_text(color="white"), line=element_line(color="white"), figure_size=figure_size)
+    )
+    return pu.figure_png(g.draw())
+
+# Run every stage for one number of cities and return a result for each stage
+def benchmark(n_cities, start_date, end_date, resolution, repeats, warmup, work_dir, seed):
+    cities = synthetic.synthetic_cities(n_cities, seed)
+    # Hourly responses also have the hourly variables, for the hourly rollups
+    variables = wdb.weather_variables + (wdb.hourly_variables if resolution == 'hourly' else [])
+    responses = synthetic.synthetic_responses(cities, start_date, end_date, resolution, variables, seed)
+    results = []
+
+    def record(stage, function, rows, setup=None, stage_repeats=repeats):
+        result = {'stage': stage, 'cities': n_cities, 'resolution': resolution, 'rows': rows}
+        result.update(measure(function, stage_repeats, warmup, setup))
+        print(f"{stage:<24}{n_cities:>8}{rows:>14,}{result['median_s']:>12.4f}{result['stdev_s']:>10.4f}{result['peak_mb']:>12.1f}")
+        results.append(result)
+
+    # Processing the api responses into one dataframe
+    df = cf.process_responses(responses, cities, variables, resolution)
+    record('process_responses', lambda: cf.process_responses(responses, cities, variables, resolution), len(df))
+    del responses
+
+    store_path = os.path.join(work_dir, f'weather_{n_cities}')
+    hourly_path = None
+    if resolution == 'hourly':
+        hourly_df = df
+        df = hourly_to_daily(hourly_df)
+        record('hourly_to_daily', lambda: hourly_to_daily(hourly_df), len(hourly_df))
+        record('hourly_rollups', lambda: wdb.hourly_rollups(hourly_df), len(hourly_df))
+        hourly_path = os.path.join(work_dir, f'weather_hourly_{n_cities}')
+        record('write_hourly_store', lambda: ws.write_weather_store(hourly_df, hourly_path, 'hourly'), len(hourly_df), stage_repeats=1)
+        del hourly_df
+
+    # Building rainy.db from the weather store. This is slow for many cities, so it is only run once after the warm up.
+    db_path = os.path.join(work_dir, f'rainy_{n_cities}.db')
+    perception_csv = os.path.join(work_dir, 'perception_data.csv')
+    synthetic.synthetic_perception(start_date.year, end_date.year, seed).to_csv(perception_csv, index=False)
+
+    record('write_weather_store', lambda: ws.write_weather_store(df, store_path), len(df), stage_repeats=1)
+    record('build_database', lambda: wdb.build_database(db_path, store_path, perception_csv, hourly_path).dispose(), len(df), stage_repeats=1)
+    rows = len(df)
+    del df
+
+    # The website reads from the finished database, so each run starts with an empty query cache
+    engine = da.get_engine(db_path)
+    city = cities[0]['city']
+    for frequency in ['Daily', 'Monthly', 'Yearly', '5 Yearly']:
+        record(f'explorer_{frequency.lower().replace(" ", "_")}',
+               lambda: da.read_weather(engine, city, start_date, end_date, wdb.weather_variables, frequency),
+               rows // n_cities, setup=da.clear_cache)
+
+    record('visualiser_draw',
+           lambda: draw_figure(engine, city, start_date, end_date, 'precipitation_sum', 'Daily'),
+           rows // n_cities, setup=da.clear_cache)
+    record('key_insights',
+           lambda: da.fetch_yearly(['precipitation_hours', 'precipitation_sum'], engine=engine),
+           rows, setup=da.clear_cache)
+    if resolution == 'hourly':
+        record('key_insights_hourly',
+               lambda: (da.fetch_wet_hours(engine=engine), da.fetch_hour_of_day(['precipitation'], engine=engine)),
+               rows * 24, setup=da.clear_cache)
+
+    engine.dispose()
+    return results
+
+# Information about the machine and code the benchmarks ran on
+def run_info(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'arguments': vars(args),
+    }
+
+# Print how much slower or faster each stage is compared with an earlier results file
+def compare(results, previous_path):
+    with open(previous_path, 'r') as f:
+        previous = {(result['stage'], result['cities'], result['resolution']): result for result in json.load(f)['results']}
+
+    print(f"\n{'stage':<24}{'cities':>8}{'before s':>12}{'after s':>12}{'change':>10}")
+    for result in results:
+        before = previous.get((result['stage'], result['cities'], result['resolution']))
+        if before:
+            change = 100 * (result['median_s'] / before['median_s'] - 1) if before['median_s'] else 0
+            print(f"{result['stage']:<24}{result['cities']:>8}{before['median_s']:>12.4f}{result['median_s']:>12.4f}{change:>9.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the data pipeline on synthetic open-meteo data')
+    parser.add_argument('--cities', type=int, nargs='+', default=[20], help='numbers of cities to run the benchmarks for')
+    parser.add_argument('--years', type=int, default=84, help='number of years of data for each city')
+    parser.add_argument('--resolution', choices=['daily', 'hourly'], default='daily', help='resolution of the synthetic api responses')
+    parser.add_argument('--repeats', type=int, default=5, help='timed runs of each stage')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs of each stage before the timed ones')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic data')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    parser.add_argument('--compare', default=None, help='earlier JSON results file to compare against')
+    args = parser.parse_args()
+
+    end_date = datetime.date(2023, 12, 31)
+    start_date = datetime.date(end_date.year - args.years + 1, 1, 1)
+
+    print(f"{'stage':<24}{'cities':>8}{'rows':>14}{'median s':>12}{'stdev s':>10}{'peak MB':>12}")
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_cities in args.cities:
+            results.extend(benchmark(n_cities, start_date, end_date, args.resolution, args.repeats, args.warmup, work_dir, args.seed))
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'run': run_info(args), 'results': results}, f, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+# Generate synthetic weather data shaped like the open-meteo API responses, so the data pipeline can be benchmarked
+# at any scale without network access. The same seed always gives the same data.
+
+# import necessary libraries
+import os
+import sys
+import re
+import datetime
+import numpy as np
+import pandas as pd
+from openmeteo_sdk.Variable import Variable
+from openmeteo_sdk.Aggregation import Aggregation
+
+# Make the modules in the notebooks folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'notebooks'))
+import weather_db as wdb
+
+# Aggregations the api names daily variables with, by the suffix it adds to the variable's name
+_aggregations = {'_min': Aggregation.minimum, '_max': Aggregation.maximum, '_mean': Aggregation.mean, '_sum': Aggregation.sum}
+
+# Split a variable name like temperature_2m_max into the variable, height above ground and aggregation the api
+# would describe it with, the reverse of custom_functions.variable_name()
+def _describe_variable(name):
+    aggregation = Aggregation.none
+    for suffix, code in _aggregations.items():
+        if name.endswith(suffix) and not hasattr(Variable, name):
+            name, aggregation = name[:-len(suffix)], code
+            break
+    altitude = 0
+    match = re.fullmatch(r'(.+)_(\d+)m', name)
+    if match and not hasattr(Variable, name):
+        name, altitude = match.group(1), int(match.group(2))
+    return getattr(Variable, name, Variable.undefined), altitude, aggregation
+
+# Stand-ins for the objects openmeteo_requests returns, with only the methods process_responses() uses
+class SyntheticVariable:
+    def __init__(self, name, values):
+        self.variable, self.altitude, self.aggregation = _describe_variable(name)
+        self.values = values
+
+    def Variable(self):
+        return self.variable
+
+    def Altitude(self):
+        return self.altitude
+
+    def Aggregation(self):
+        return self.aggregation
+
+    def ValuesAsNumpy(self):
+        return self.values
+
+class SyntheticBlock:
+    def __init__(self, start, end, interval, variables, values):
+        self.start = start
+        self.end = end
+        self.interval = interval
+        self.variables = variables
+        self.values = values
+
+    def Time(self):
+        return self.start
+
+    def TimeEnd(self):
+        return self.end
+
+    def Interval(self):
+        return self.interval
+
+    def VariablesLength(self):
+        return len(self.values)
+
+    def Variables(self, i):
+        return SyntheticVariable(self.variables[i], self.values[i])
+
+class SyntheticResponse:
+    def __init__(self, latitude, longitude, daily=None, hourly=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.daily = daily
+        self.hourly = hourly
+
+    def Latitude(self):
+        return self.latitude
+
+    def Longitude(self):
+        return self.longitude
+
+    def UtcOffsetSeconds(self):
+        return 0
+
+    def Daily(self):
+        return self.daily
+
+    def Hourly(self):
+        return self.hourly
+
+# Make up `n` geocoded cities spread over the globe, in the same format geocoding.geocode_cities() returns
+def synthetic_cities(n, seed=0):
+    rng = np.random.default_rng(seed)
+    latitudes = rng.uniform(-60, 70, n)
+    longitudes = rng.uniform(-180, 180, n)
+    return [{'city': f'City {i:04d}', 'latitude': round(float(latitude), 4), 'longitude': round(float(longitude), 4)}
+            for i, (latitude, longitude) in enumerate(zip(latitudes, longitudes))]
+
+# Make up plausible values for each weather variable at the given times (seconds since 1970) for a city at `latitude`.
+# Temperatures and daylight follow the seasons, with colder winters further from the equator, and about half the
+# steps are dry. Hourly values use the same formulas so they have the same shape as the daily ones.
+def _synthetic_values(times, latitude, variables, interval, rng):
+    day_of_year = (times // 86400 + 4) % 365.25
+    season = np.cos(2 * np.pi * (day_of_year - 196) / 365.25) * np.sign(latitude or 1)
+    mean_temperature = 25 - 0.4 * abs(latitude) + 0.2 * abs(latitude) * season + rng.normal(0, 3, len(times))
+    daylight = (12 + 4 * (abs(latitude) / 60) * season) * 3600 * (interval / 86400)
+    wet = rng.random(len(times)) < 0.5
+    precipitation = np.where(wet, rng.gamma(0.8, 6 * interval / 86400, len(times)), 0)
+
+    generated = {
+        'temperature_2m_max': mean_temperature + rng.uniform(2, 8, len(times)),
+        'temperature_2m_min': mean_temperature - rng.uniform(2, 8, len(times)),
+        'temperature_2m_mean': mean_temperature,
+        'daylight_duration': daylight,
+        'sunshine_duration': daylight * rng.uniform(0, 0.9, len(times)),
+        'precipitation_sum': precipitation,
+        'rain_sum': np.where(mean_temperature > 0, precipitation, 0),
+        'precipitation_hours': np.where(wet, rng.integers(1, 24, len(times)) if interval == 86400 else 1, 0),
+        # Hourly variables
+        'temperature_2m': mean_temperature,
+        'relative_humidity_2m': np.clip(70 + 20 * wet + rng.normal(0, 10, len(times)), 0, 100),
+        'precipitation': precipitation,
+        'rain': np.where(mean_temperature > 0, precipitation, 0),
+        'cloud_cover': np.clip(50 + 40 * wet + rng.normal(0, 20, len(times)), 0, 100),
+        'wind_speed_10m': rng.gamma(2, 6, len(times)),
+    }
+    # Any other variable gets values around zero
+    return [generated.get(variable, rng.normal(0, 1, len(times))).astype('float32') for variable in variables]
+
+# Make one synthetic api response for each city covering start_date to end_date (inclusive)
+def synthetic_responses(cities, start_date, end_date, resolution='daily', variables=wdb.weather_variables, seed=0):
+    rng = np.random.default_rng(seed)
+    interval = 86400 if resolution == 'daily' else 3600
+    start = int(datetime.datetime.combine(start_date, datetime.time(), datetime.timezone.utc).timestamp())
+    end = int(datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time(), datetime.timezone.utc).timestamp())
+    times = np.arange(start, end, interval)
+
+    responses = []
+    for city in cities:
+        values = _synthetic_values(times, city['latitude'], variables, interval, rng)
+        block = SyntheticBlock(start, end, interval, variables, values)
+        if resolution == 'daily':
+            responses.append(SyntheticResponse(city['latitude'], city['longitude'], daily=block))
+        else:
+            responses.append(SyntheticResponse(city['latitude'], city['longitude'], hourly=block))
+    return responses
+
+# Make up a perception table (one row per year) in the same format as data/perception_data.csv
+def synthetic_perception(start_year=1940, end_year=2019, seed=0):
+    rng = np.random.default_rng(seed)
+    years = np.arange(start_year, end_year + 1)
+    df = pd.DataFrame({'year': years})
+    for variable in wdb.perception_variables:
+        if variable.endswith('absolute_appearances'):
+            df[variable] = rng.integers(1000, 100000, len(years))
+        else:
+            df[variable] = rng.uniform(50, 150, len(years))
+    return df
@@ -1,5 +1,11 @@
 import streamlit as st
 import pandas as pd
+import sys
+
+# Make the modules in the notebooks folder importable from the website
+sys.path.append('notebooks')
+import weather_store as ws
+import perf
 
 logo_path = "docs/images/RubberDucksLogo.png"
 
@@ -9,6 +15,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# Time this rerun if performance timing is switched on (RUBBERDUCKS_PERF=1)
+perf.start_page()
+
 # Create header for the webpage with the name of our project and group logo.
 # Use two columns to display the logo next to the text.
 col1, col2 = st.columns([1, 8])
@@ -42,7 +51,7 @@ st.graphviz_chart(
     K [label="Python list of\ndictionaries for coordinates\nof all cities"]
     X [label="open-meteo API call dictionary"]
     M [label="Weather Dataframe: each row is a time and city"]
-    F [label="Save as .csv files"]
+    F [label="Save as .csv files\nand a columnar store"]
     N [label="Google NGRAMS"]
     S [label="JSON format"]
     T [label="Dataframe of appearance % for each NGRAM"]
@@ -119,6 +128,8 @@ sel = Selector(response)
 cities = sel.xpath("//table//tr/td[2]/text()").getall()
 ```
 
+This request (and every other request we make to collect our data) now goes through one shared cache of responses on disk, with its own lifetime for each website's responses, so rerunning the whole pipeline only takes seconds. Setting ```RUBBERDUCKS_HTTP_MODE=replay``` even runs it completely offline from the recorded responses.
+
 This simply returns a list of the top 20 most visited cities:
 ```python
 ['Bangkok', 'Paris', 'London', 'Dubai', 'Singapore', 'Kuala Lumpur', 'New York', 'Istanbul', 'Tokyo', 'Antalya', 'Seoul', 'Osaka', 'Makkah', 'Phuket', 'Pattaya', 'Milan', 'Barcelona', 'Palma de Mallorca', 'Bali', 'Hong Kong SAR']
@@ -144,6 +155,8 @@ def geocode_cities(city_list):
 geocoded_cities = geocode_cities(cities)
 ```
 
+We have since moved this into a ```geocoding``` module that saves every result to a cache file and only looks each city up once, spreading any new lookups across a few workers while staying within the API's rate limit, so re-running it for cities we've already seen is instant.
+
 This returned a list of dictionaries that we then exported as a JSON file - here is a clipping of the first three cities:
 """
 
@@ -164,24 +177,25 @@ params = {
 
 ### Step 3
 
-Only now were we finally ready for the actual API call where we created a custom function ```process_response()``` using the API documentation that processed each response into a pandas dataframe before we merged them and exported it as a CSV.
+Only now were we finally ready for the actual API call where we created a custom function ```process_response()``` using the API documentation that processed each response into a pandas dataframe before we merged them and wrote them to our columnar weather store (one Arrow file per city, with float32 columns, so we can read just the cities, years and columns we need).
 
 ```python
-# Setup the Open-Meteo API client with cache and retry on error
-cache_session = requests_cache.CachedSession('.cache', expire_after = -1)
-retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
-openmeteo = openmeteo_requests.Client(session = retry_session)
+# Setup the Open-Meteo API client with the shared response cache and retry on error
+openmeteo = openmeteo_requests.Client(session = http_utils.cached_session(retries = 5, backoff_factor = 0.2))
 
 url = "https://archive-api.open-meteo.com/v1/archive"
 responses = openmeteo.weather_api(url, params=params)
 
-dataframes_list = [cf.process_response(response, geocoded_cities, i) for i, response in enumerate(responses)]
-merged_df = pd.concat(dataframes_list, ignore_index=True)
-merged_df.to_csv("../data/weather_data.csv", index=False)
+merged_df = cf.process_responses(responses, geocoded_cities)
+ws.write_weather_store(merged_df, "../data/weather")
 ```
+```process_responses()``` started out as a loop over ```process_response()``` followed by a ```pd.concat```, but it now fills the measurements for every city into a single block of memory and stores the city as a categorical column, which keeps it fast even with thousands of locations.
+Holding every response and the merged dataframe at once still needs memory in proportion to the number of cities, so the notebook now calls ```ingest.stream_weather()``` instead, which requests a few cities at a time and writes each chunk to the store (or straight into ```rainy.db```) before requesting the next.
+The same function can also collect hourly weather (```resolution='hourly'```), which is kept in its own compact store and summarised into ```rainy.db``` for the hourly charts on the Key Insights page.
 Here are the first 20 rows for your enjoyment (there are 600,000 total):
 """
-df = pd.read_csv('data/weather_data.csv').head(20) # update file path when in the github repository.
+with perf.span('read_store_head'):
+    df = ws.head(20) # Only reads the first year of the first city from the store
 
 st.dataframe(df)
 
@@ -240,6 +254,8 @@ for query in queries_rain:
 
 We end up with 3 dataframes: NGRAMSrain_df, NGRAMSsun_df and NGRAMSwind_df.
 
+We later replaced this loop with ```get_NGRAMS_batch```, which packs many queries into each request (the API accepts comma separated phrases), sends the requests concurrently over one shared connection pool and builds a single long format dataframe in one go. The year range and corpus are parameters rather than being fixed to 1940 and ```en-2019```.
+
 ### Step 3
 In each dataframe, we summed up all different queries' appearances for each year. This enabled us to have a general perception for a given year. The associated new dataframes were named NGRAMSrain_df_grouped, NGRAMSsun_df_grouped and NGRAMSwind_df_grouped.
 
@@ -251,7 +267,8 @@ We merged the 3 dataframes into one general perception dataframe NGRAMS_df_group
 
 """
 
-df = pd.read_csv('data/perception_data.csv')
+with perf.span('read_perception_csv'):
+    df = pd.read_csv('data/perception_data.csv')
 
 st.dataframe(df)
 
@@ -336,4 +353,7 @@ def filter_weather_words(suggestion_dict):
     return new_dict
 ```
 
-"""
\ No newline at end of file
+"""
+
+# Show where the time of this rerun went, if performance timing is switched on
+perf.show_panel()
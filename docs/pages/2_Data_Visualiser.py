@@ -1,10 +1,16 @@
 import streamlit as st
 import json
 import datetime
-from sqlalchemy import create_engine
-import pandas as pd
+import sys
 from plotnine import *
 
+# Make the modules in the notebooks folder importable from the website
+sys.path.append('notebooks')
+import data_access as da
+import wordclouds as wc
+import plot_utils as pu
+import perf
+
 logo_path = "docs/images/RubberDucksLogo.png"
 
 st.set_page_config(
@@ -13,6 +19,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# Time this rerun if performance timing is switched on (RUBBERDUCKS_PERF=1)
+perf.start_page()
+
 # Create header for the webpage with the name of our project and group logo.
 # Use two columns to display the logo next to the text.
 col1, col2 = st.columns([1, 8])
@@ -22,11 +31,8 @@ with col1:
 with col2:
     st.markdown("<h1 style='font-size: 80px;'>Data Visualiser</h1>", unsafe_allow_html=True)
 
-# Create a database engine
-engine = create_engine('sqlite:///data/rainy.db', echo=False, isolation_level="AUTOCOMMIT")
-
-with engine.connect() as conn:
-    pass
+# Get the database engine shared by every page and user
+engine = da.get_engine()
 
 ## Define variables and dictionaries for the data explorer and visualiser.
 # Read the city coordinates json to get the list of cities we have data on.
@@ -47,13 +53,6 @@ variables_dict = {
     'Precipitation Hours': 'precipitation_hours'
 }
 
-# Create a dictionary of frequencies available for analysis.
-freq_dict = {
-    'Monthly': 'M',
-    'Yearly': 'Y',
-    '5 Yearly': '5Y'
-}
-
 # Create three tabs: one for each tool
 explorerTab, visualiserTab, wordcloudTab = st.tabs(["Explorer", "Visualiser", "Wordcloud"])
 
@@ -61,14 +60,14 @@ with explorerTab:
     """
     # Weather Data Explorer
 
-    Select a city, time period and the indicators of your choice:
+    Select one or more cities, a time period and the indicators of your choice:
     """
 
 # Create the data explorer options selector.
     col1, col2, col3 = st.columns(3)
 
     with col1: 
-        city_selection_de = st.selectbox('City', cities)
+        city_selection_de = st.multiselect('Cities', cities, default=cities[0])
         start_date_selection_de = st.date_input("Start date", value=datetime.datetime(1940, 1, 1), min_value=datetime.datetime(1940, 1, 1), max_value=datetime.datetime(2023, 12, 30))
 
     end_date_selection_de_min = start_date_selection_de + datetime.timedelta(days=1)
@@ -79,57 +78,32 @@ with explorerTab:
 
     with col3:
         selected_keys_de = st.multiselect("Indicators", list(variables_dict.keys()), default=list(variables_dict.keys())[0])
+        layout_de = st.radio("Table layout", ['Long', 'Wide'], horizontal=True, help="Long has a row for every city and date, wide has a column for every city and indicator")
 
 # Convert the list of selected indicators into their variable names.
     selected_indicators_de = [variables_dict[key] for key in selected_keys_de]
 
 ## Create the custom dataframe.
-# Generate the query for the database:
-    if selected_indicators_de != []:
-        query = f"""
-            SELECT city, date, {', '.join(selected_indicators_de)}
-            FROM weather
-            WHERE city = '{city_selection_de}'
-            AND date BETWEEN '{start_date_selection_de}' AND '{end_date_selection_de}';
-        """
-    else:
-        query = f"""
-            SELECT city, date
-            FROM weather
-            WHERE city = '{city_selection_de}'
-            AND date BETWEEN '{start_date_selection_de}' AND '{end_date_selection_de}';
-        """
-
-# Read in the database to a dataframe
-    df = pd.read_sql(query, engine)
-
-# Set the date column to datetime format
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-
-# Drop the city column so when resampling, each column is numeric (except for the date).
-    df.drop(columns='city', inplace=True)
+# Read the data for every selected city with one query, using the pre-aggregated rollup tables when resampling.
+    if city_selection_de:
+        with perf.span('explorer_read_weather'):
+            df = da.read_weather_cities(engine, city_selection_de, start_date_selection_de, end_date_selection_de, selected_indicators_de, frequency_selection_de)
 
-# Convert columns to numeric format.
-    for column in selected_indicators_de:
-        df[column] = pd.to_numeric(df[column].astype(str).str.replace(',', ''), errors='coerce')
-
-# Resample the data if needed.
-    if frequency_selection_de != 'Daily':
-        df = df.resample(freq_dict[frequency_selection_de]).mean()
-
-# Add the city back to the dataframe
-    df.insert(0, 'city', city_selection_de)
+        if layout_de == 'Wide':
+            df = da.to_wide(df)
 
 # Display the custom dataframe
-    st.dataframe(df)
+        with perf.span('explorer_show_dataframe'):
+            st.dataframe(df)
+    else:
+        st.write("Select at least one city to explore its weather.")
 
 with visualiserTab:
 
     """
     # Weather Data Visualiser
 
-    Select a city, time period and the indicator of your choice:
+    Select one or more cities, a time period and the indicator of your choice:
     """
 
 # Create a dictionary of the plotting options available.
@@ -143,7 +117,7 @@ with visualiserTab:
     col1, col2, col3 = st.columns(3)
 
     with col1: 
-        city_selection_dv = st.selectbox('City', cities, key='dv_city')
+        city_selection_dv = st.multiselect('Cities', cities, default=cities[0], key='dv_cities')
         start_date_selection_dv = st.date_input("Start date", value=datetime.datetime(1940, 1, 1), min_value=datetime.datetime(1940, 1, 1), max_value=datetime.datetime(2023, 12, 30), key='dv_start')
 
     end_date_selection_dv_min = start_date_selection_dv + datetime.timedelta(days=1)
@@ -158,56 +132,75 @@ with visualiserTab:
         plot_type = plot_dict[plot_option]
 
     selected_indicator_dv = variables_dict[selected_key_dv]
+
+# Every figure is cached on the full selection (and the version of the database it was drawn from),
+# so repeat views skip the query and matplotlib completely.
+    figure_selection = (tuple(city_selection_dv), str(start_date_selection_dv), str(end_date_selection_dv), frequency_selection_dv, selected_indicator_dv, plot_option, da.data_version(engine))
+    cached_figure = pu.figure_cache.get(figure_selection) if city_selection_dv else None
+
+    if not city_selection_dv:
+        image = None
+    elif cached_figure is None:
 ## Create the custom dataframe.
-# Generate the query for the database:
-    query = f"""
-            SELECT city, date, {selected_indicator_dv}
-            FROM weather
-            WHERE city = '{city_selection_dv}'
-            AND date BETWEEN '{start_date_selection_dv}' AND '{end_date_selection_dv}';
-        """
-
-# Read in the database to a dataframe
-    df = pd.read_sql(query, engine)
-
-# Set the date column to datetime format
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-
-# Drop the city column so when resampling, each column is numeric (except for the date).
-    df.drop(columns='city', inplace=True)
-
-# Convert columns to numeric format.
-    df[selected_indicator_dv] = pd.to_numeric(df[selected_indicator_dv].astype(str).str.replace(',', ''), errors='coerce')
-
-# Resample the data if needed.
-    if frequency_selection_dv != 'Daily':
-        df = df.resample(freq_dict[frequency_selection_dv]).mean()
-
-# Add the city back to the dataframe
-    df.insert(0, 'city', city_selection_dv)
-
-# Create the plot
-    g = (
-        ggplot(df, aes(x=df.index, y=selected_indicator_dv, color=selected_indicator_dv, fill=selected_indicator_dv)) +
-        plot_type +
-        labs(x='Date', y=selected_key_dv) +
-        theme_minimal() +
-        theme(text=element_text(color="white"),line=element_line(color="white"), figure_size=(10,6))
-    )
-
-# Draw the plot for use with the streamlit.pyplot() function.
-    fig = g.draw()
+# Read the data for every selected city with one query, using the pre-aggregated rollup tables when resampling.
+        with perf.span('visualiser_read_weather'):
+            df = da.read_weather_cities(engine, city_selection_dv, start_date_selection_dv, end_date_selection_dv, [selected_indicator_dv], frequency_selection_dv)
+
+# Downsample long series to the number of points the figure can actually show, keeping every peak and trough of every city.
+        figure_size = (10, 6)
+        original_points = len(df)
+        with perf.span('downsample'):
+            df = pu.downsample_groups(df, selected_indicator_dv, 'city', figure_width=figure_size[0])
+
+# Create the plot, with one series for each city when comparing cities
+        if len(city_selection_dv) > 1:
+            plot_aes = aes(x=df.index, y=selected_indicator_dv, color='city', fill='city')
+        else:
+            plot_aes = aes(x=df.index, y=selected_indicator_dv, color=selected_indicator_dv, fill=selected_indicator_dv)
+        g = (
+            ggplot(df, plot_aes) +
+            plot_type +
+            labs(x='Date', y=selected_key_dv) +
+            theme_minimal() +
+            theme(text=element_text(color="white"),line=element_line(color="white"), figure_size=figure_size)
+        )
+
+# Draw the plot and render it to an image we can cache and show on the website.
+        with perf.span('draw'):
+            fig = g.draw()
+        with perf.span('figure_png'):
+            image = pu.figure_png(fig)
+        figure_info = {'points': len(df), 'original_points': original_points}
+        pu.figure_cache.put(figure_selection, image, figure_info)
+    else:
+        image, figure_info = cached_figure
 
     col1, col2, col3 = st.columns([1,6,1]) # Use columns to adjust size of plot on website.
     with col2:
-        st.pyplot(fig)
+        if image is None:
+            st.write("Select at least one city to plot its weather.")
+        else:
+            with perf.span('show_image'):
+                st.image(image, use_column_width=True)
+            st.caption(f"Showing {figure_info['points']:,} of {figure_info['original_points']:,} data points")
 
 with wordcloudTab:
-    city_wc = st.selectbox("Select a city to view its perception word cloud from Google Autosuggestions", (cities), key='wc_city')
+# Read the words from the Google auto suggestions for every city we have collected them for.
+    with open('data/auto_suggestion_words.json', 'r') as f:
+        suggestion_words = json.load(f)
+
+    city_wc = st.selectbox("Select a city to view its perception word cloud from Google Autosuggestions", list(suggestion_words), key='wc_city')
 
     st.write(f"# Wordcloud for {city_wc}")
 
-    image_path = f"./docs/images/wordclouds/{city_wc}.png"
+# Use the pre-rendered image if it is up to date, otherwise render (and cache) one for this city.
+    with perf.span('get_wordcloud'):
+        image_path = wc.get_wordcloud(city_wc, suggestion_words[city_wc])
+
+    if image_path:
+        st.image(image_path, use_column_width=True)
+    else:
+        st.write("There are no Google auto suggestions for this city yet.")
 
-    st.image(image_path, use_column_width=True)
\ No newline at end of file
+# Show where the time of this rerun went, if performance timing is switched on
+perf.show_panel(('Query cache', da.cache_stats()), ('Figure cache', pu.figure_cache.stats()))
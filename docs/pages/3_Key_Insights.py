@@ -1,14 +1,14 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from sqlalchemy import create_engine
+import sys
 
-logo_path = "docs/images/RubberDucksLogo.png"
-
-engine = create_engine('sqlite:///data/rainy.db', echo=False, isolation_level="AUTOCOMMIT")
+# Make the modules in the notebooks folder importable from the website
+sys.path.append('notebooks')
+import data_access as da
+import perf
 
-with engine.connect() as conn:
-    pass
+logo_path = "docs/images/RubberDucksLogo.png"
 
 st.set_page_config(
     page_title="Key Insights",
@@ -16,6 +16,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# Time this rerun if performance timing is switched on (RUBBERDUCKS_PERF=1)
+perf.start_page()
+
 # Create header for the webpage with the name of our project and group logo.
 # Use two columns to display the logo next to the text.
 col1, col2 = st.columns([1, 8])
@@ -113,64 +116,87 @@ with col2:
 st.divider()
 
 '''
-Use the sliders below to adjust the time frames, click the cities on the right to hide them and have a closer look at how precipitation patterns changed across time for different cities.
+### Does it drizzle all the time, or just on the way to work?
 '''
 
 st.divider()
 
-col1, col2, col3 = st.columns([10,1,10])
+# The hourly charts are built from the hourly rollup tables, which are only in the database if the hourly weather was collected
+if da.has_hourly_rollups():
+    wet_df = da.fetch_wet_hours() # Cached until the database changes
+    hour_df = da.fetch_hour_of_day(['precipitation'])
+    hour_df['wet_share'] *= 100
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        with perf.span('plotly_figure'):
+            fig_3 = px.bar(wet_df, x='city', y=['wet_hours', 'wet_commute_hours'], barmode='group',
+                           title='Average Wet Hours a Day',
+                           labels={'value': 'Hours', 'city': 'City', 'variable': ''})
+            fig_3.for_each_trace(lambda trace: trace.update(name={'wet_hours': 'All day', 'wet_commute_hours': 'Commuting hours'}[trace.name]))
+
+        with perf.span('plotly_chart'):
+            st.plotly_chart(fig_3)
+
+    with col2:
+        with perf.span('plotly_figure'):
+            fig_4 = px.line(hour_df, x='hour', y='wet_share', color='city',
+                            title='Share of Hours With Rain by Hour of the Day (local time)',
+                            labels={'wet_share': 'Wet hours (%)', 'hour': 'Hour ending', 'city': 'City'})
+            # Shade the morning and evening commutes
+            for start, end in [(7.5, 9.5), (16.5, 19.5)]:
+                fig_4.add_vrect(x0=start, x1=end, fillcolor='grey', opacity=0.15, line_width=0)
+
+        with perf.span('plotly_chart'):
+            st.plotly_chart(fig_4)
 
-with col1:
-    query = f'''
-            SELECT 
-                strftime("%Y", date) AS year,
-                SUM(precipitation_hours) AS precipitation_hours,
-                city
-            FROM 
-                weather
-            GROUP BY 
-                year,
-                city;
     '''
+    Using hourly rather than daily weather we can count the hours in which at least 0.1mm of rain fell, and see when during the day they happen. The left chart compares how many hours a day are wet on average in each city, both over the whole day and over the commuting hours (7-9am and 4-7pm), and the right one shows how likely it is to be raining at each hour of the day, with the commutes shaded. Click the cities on the right to hide them and compare London with the others.
+    '''
+else:
+    st.info("These charts need the hourly weather, which is collected by the optional hourly cells in NB01 (or `python notebooks/pipeline.py --hourly`).")
 
-    df = pd.read_sql(query, engine)
-    df['year'] = pd.to_datetime(df['year'])
+st.divider()
 
+'''
+Use the sliders below to adjust the time frames, click the cities on the right to hide them and have a closer look at how precipitation patterns changed across time for different cities.
+'''
+
+st.divider()
+
+# Read the yearly totals for every city from the yearly summary table built with the database.
+# One small query covers both charts instead of aggregating the whole weather table twice.
+df = da.fetch_yearly(['precipitation_hours', 'precipitation_sum']) # Cached until the database changes
+df['year'] = pd.to_datetime(df['year'])
+
+col1, col2, col3 = st.columns([10,1,10])
+
+with col1:
     # Creating Plotly figure
-    fig_1 = px.line(df, x='year', y='precipitation_hours', color='city',
-                    title='Yearly Precipitation Hours Across 20 Cities (1940-2024)',
-                    labels={'precipitation_hours': 'Total Precipitation Hours', 'year': 'Year', 'city': 'City'})
+    with perf.span('plotly_figure'):
+        fig_1 = px.line(df, x='year', y='precipitation_hours', color='city',
+                        title='Yearly Precipitation Hours Across 20 Cities (1940-2024)',
+                        labels={'precipitation_hours': 'Total Precipitation Hours', 'year': 'Year', 'city': 'City'})
 
     # Adding a range slider for year selection
     fig_1.update_layout(xaxis=dict(rangeslider=dict(visible=True)))
 
-    st.plotly_chart(fig_1)
+    with perf.span('plotly_chart'):
+        st.plotly_chart(fig_1)
 
 with col3:
-    query = f'''
-            SELECT 
-                strftime("%Y", date) AS year,
-                SUM(precipitation_sum) AS precipitation_sum,
-                city
-            FROM 
-                weather
-            GROUP BY 
-                year,
-                city;
-    '''
-
-    df = pd.read_sql(query, engine)
-    df['year'] = pd.to_datetime(df['year'])
-
     # Creating Plotly figure
-    fig_2 = px.line(df, x='year', y='precipitation_sum', color='city',
-                    title='Yearly Precipitation Sum Across 20 Cities',
-                    labels={'precipitation_sum': 'Total Precipitation (mm)', 'year': 'Year', 'city': 'City'})
+    with perf.span('plotly_figure'):
+        fig_2 = px.line(df, x='year', y='precipitation_sum', color='city',
+                        title='Yearly Precipitation Sum Across 20 Cities',
+                        labels={'precipitation_sum': 'Total Precipitation (mm)', 'year': 'Year', 'city': 'City'})
 
     # Adding a range slider for year selection
     fig_2.update_layout(xaxis=dict(rangeslider=dict(visible=True)))
 
-    st.plotly_chart(fig_2)
+    with perf.span('plotly_chart'):
+        st.plotly_chart(fig_2)
 
 st.divider()
 
@@ -212,4 +238,7 @@ st.divider()
 
 '''
 The question we set out to answer with this project was whether or not London is a rainy city, and while it certainly rains here (often at the most inconvenient times like on the way to class or when you planned to go to the park), it seems its reputation as a rainy city is probably unjustified. Through our research we found that the stereotype of London as a rainy city has became most prominent during the 2000s, but in reality, London's weather patterns in that period were less rainy and more sunny compared to at other points in its history. We also found that out of the top 20 most visited cities worldwide, London does not stand out as a particularly rainy city being only 16th out of 20 in terms of the average amount of rainfall. So maybe its time for us to collectively hang up the notion that London is an outlier in terms of raininess and think about the things that really stand out about this city.
-'''
\ No newline at end of file
+'''
+
+# Show where the time of this rerun went, if performance timing is switched on
+perf.show_panel(('Query cache', da.cache_stats()))
@@ -0,0 +1,139 @@
+# Build rainy.db from the weather data and perception CSV as fast as SQLite allows.
+# Rather than going through DataFrame.to_sql, the rows are handed straight to sqlite3's executemany in batches,
+# inside a few large transactions, with the pragmas below switched on while loading. The weather is read a city
+# (or a CSV chunk) at a time, so the memory needed doesn't grow with the number of cities.
+#
+# The weather table's primary key is the table itself (it is a WITHOUT ROWID table), so it can't be built after the
+# load. Instead the rows go in sorted by city and date, so every insert lands at the end of the table rather than
+# in the middle. The rollup tables and their indexes are built once all the rows are in, and ANALYZE runs last so
+# the query planner knows how big every table and index is.
+#
+# Usage (from the repository root):
+#   python notebooks/bulk_load.py data/rainy.db data/weather data/perception_data.csv
+
+# import necessary libraries
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+from sqlalchemy import create_engine, event, text
+
+# Make the other modules in this folder importable when run as a script
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import weather_db as wdb
+import perf
+
+# Pragmas used while loading. Nothing is journaled or synced to disk until the end, which is safe here because an
+# interrupted load is simply run again from scratch. Bigger pages and a bigger page cache mean fewer, larger writes.
+load_pragmas = {
+    'journal_mode': 'OFF',
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+    'cache_size': -256 * 1024,  # in KiB, so 256MB
+}
+
+# Page size of the database file in bytes
+page_size = 16384
+
+# Rows passed to each executemany call
+batch_rows = 50000
+
+# Rows inserted in each transaction
+transaction_rows = 1000000
+
+# Engine that sets the load pragmas on every connection it opens
+def _load_engine(db_path):
+    engine = create_engine(f'sqlite:///{db_path}', echo=False)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in load_pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value};")
+        cursor.close()
+
+    return engine
+
+# Insert the rows of a validated dataframe in batches of `batch_rows`, committing every `transaction_rows` rows.
+# Returns the number of rows in the current transaction afterwards.
+def _insert_rows(connection, table, df, pending_rows):
+    columns = list(df.columns)
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))});"
+    cursor = connection.cursor()
+    for start in range(0, len(df), batch_rows):
+        batch = df.iloc[start:start + batch_rows]
+        cursor.executemany(insert, wdb.row_tuples(batch))
+        pending_rows += len(batch)
+        if pending_rows >= transaction_rows:
+            connection.commit()
+            pending_rows = 0
+    cursor.close()
+    return pending_rows
+
+# Build rainy.db from scratch using the weather data (the columnar store or a CSV) and perception CSV created in NB01.
+# The hourly rollups are also built if the hourly weather store in `hourly_source` has any cities in it.
+# Returns the number of rows loaded, how long it took and the rows loaded per second.
+@perf.timed()
+def bulk_load(db_path, weather_source, perception_csv, hourly_source=None):
+    start = time.perf_counter()
+    engine = _load_engine(db_path)
+
+    with engine.begin() as conn:
+        for table in ['weather', 'perception'] + list(wdb.rollup_tables) + list(wdb.hourly_rollup_tables):
+            conn.execute(text(f"DROP TABLE IF EXISTS {table};"))
+
+    # The page size only changes when the file is rebuilt, which is quick now that it is empty. This also clears out
+    # the space left by the old tables.
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"PRAGMA page_size = {page_size};"))
+        conn.execute(text("VACUUM;"))
+
+    wdb.create_schema(engine)
+
+    weather_rows = 0
+    connection = engine.raw_connection()
+    try:
+        pending_rows = 0
+        for df in wdb.iter_weather_source(weather_source):
+            clean_df = wdb.validate_weather(df).sort_values(['city', 'date'])
+            pending_rows = _insert_rows(connection, 'weather', clean_df, pending_rows)
+            weather_rows += len(clean_df)
+
+        perception_df = wdb.validate_perception(pd.read_csv(perception_csv))
+        _insert_rows(connection, 'perception', perception_df, pending_rows)
+        connection.commit()
+    finally:
+        connection.close()
+    load_seconds = time.perf_counter() - start
+
+    wdb.build_rollups(engine)
+    if hourly_source is not None:
+        wdb.build_hourly_rollups(engine, hourly_source)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE;"))
+    engine.dispose()
+
+    seconds = time.perf_counter() - start
+    return {
+        'weather_rows': weather_rows,
+        'perception_rows': len(perception_df),
+        'load_s': round(load_seconds, 3),
+        'total_s': round(seconds, 3),
+        'rows_per_s': round(weather_rows / load_seconds),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Build rainy.db from the weather data and perception CSV')
+    parser.add_argument('db_path', help='database file to build')
+    parser.add_argument('weather_source', help='weather store folder or weather CSV file')
+    parser.add_argument('perception_csv', help='perception CSV file')
+    parser.add_argument('--hourly', default=None, help='hourly weather store folder to build the hourly rollups from')
+    args = parser.parse_args()
+
+    stats = bulk_load(args.db_path, args.weather_source, args.perception_csv, args.hourly)
+    print(f"Loaded {stats['weather_rows']} weather rows in {stats['load_s']}s ({stats['rows_per_s']} rows/s), "
+          f"{stats['total_s']}s including the rollups")
+
+if __name__ == '__main__':
+    main()
@@ -1,69 +1,169 @@
 # import necessary libraries
 import pandas as pd
+import numpy as np
 import openmeteo_requests
+from openmeteo_sdk.Variable import Variable
+from openmeteo_sdk.Aggregation import Aggregation
 import requests
-import urllib
 import re
+from concurrent.futures import ThreadPoolExecutor
+import http_utils
+import perf
+from weather_db import weather_variables
 
 # Function for processing the weather api response
 # Made using the documentation for the openmeteo_api
 def process_response(response, geocoded_cities, i):
-    daily = response.Daily()
-    temperature_2m_max = daily.Variables(0).ValuesAsNumpy()
-    temperature_2m_min = daily.Variables(1).ValuesAsNumpy()
-    temperature_2m_mean = daily.Variables(2).ValuesAsNumpy()
-    daylight_duration = daily.Variables(3).ValuesAsNumpy()
-    sunshine_duration = daily.Variables(4).ValuesAsNumpy()
-    precipitation_sum = daily.Variables(5).ValuesAsNumpy()
-    rain_sum = daily.Variables(6).ValuesAsNumpy()
-    precipitation_hours = daily.Variables(7).ValuesAsNumpy()
-
-    daily_data = {
-        "date": pd.date_range(
-            start=pd.to_datetime(daily.Time(), unit="s", utc=True),
-            end=pd.to_datetime(daily.TimeEnd(), unit="s", utc=True),
-            freq=pd.Timedelta(seconds=daily.Interval()),
-            inclusive="left"
-        ).date
+    return process_responses([response], [geocoded_cities[i]])
+
+# Names of the api's variables and the suffixes it adds to them for daily aggregations
+_variable_names = {code: name for name, code in vars(Variable).items() if not name.startswith('_')}
+_aggregation_suffixes = {Aggregation.minimum: '_min', Aggregation.maximum: '_max', Aggregation.mean: '_mean', Aggregation.sum: '_sum'}
+
+# Work out the name a variable in an api response was requested by, such as temperature_2m_max, from the
+# variable, height above ground and aggregation the response describes it with
+def variable_name(variable):
+    name = _variable_names.get(variable.Variable(), 'undefined')
+    if variable.Altitude():
+        name += f'_{variable.Altitude()}m'
+    return name + _aggregation_suffixes.get(variable.Aggregation(), '')
+
+# Find where each of the variables is in a daily or hourly block of an api response
+def _variable_positions(block, variables):
+    positions = {variable_name(block.Variables(j)): j for j in range(block.VariablesLength())}
+    missing = [variable for variable in variables if variable not in positions]
+    if missing:
+        raise ValueError(f"Variables missing from the api response: {missing}")
+    return [positions[variable] for variable in variables]
+
+# Work out the timestamps covered by a daily or hourly block of an api response, shifted by the location's UTC offset
+def _response_times(block, resolution, unit, utc_offset=0):
+    times = np.arange(block.Time() + utc_offset, block.TimeEnd() + utc_offset, block.Interval()).astype('datetime64[s]')
+    if resolution == 'daily':
+        times = times.astype('datetime64[D]')
+    return times.astype(unit)
+
+# Function for processing every weather api response at once into a single dataframe.
+# One block of memory is allocated for the measurements of all the locations and filled in place straight from the
+# responses, the city is stored as a categorical and locations covering the same dates share one date index.
+# Variables are found in the responses by name, so they don't have to be in the order they were requested in.
+# Times are in each location's own time zone if one was requested (hourly data uses timezone=auto) and GMT otherwise.
+# With compact=True the measurements are float32 and the dates are stored to the second, halving the memory needed.
+@perf.timed()
+def process_responses(responses, geocoded_cities, variables=weather_variables, resolution='daily', compact=False):
+    dtype, unit = ('float32', 'datetime64[s]') if compact else ('float64', 'datetime64[ns]')
+    blocks = [response.Daily() if resolution == 'daily' else response.Hourly() for response in responses]
+    utc_offsets = [response.UtcOffsetSeconds() for response in responses]
+    spans = [(block.Time(), block.TimeEnd(), block.Interval(), utc_offset) for block, utc_offset in zip(blocks, utc_offsets)]
+    lengths = np.array([(end - start) // interval for start, end, interval, _ in spans], dtype='int64')
+    offsets = np.r_[0, np.cumsum(lengths)]
+
+    # Fill the measurements of every location into one preallocated array
+    values = np.empty((len(variables), offsets[-1]), dtype=dtype)
+    for block, start, end in zip(blocks, offsets[:-1], offsets[1:]):
+        for j, position in enumerate(_variable_positions(block, variables)):
+            values[j, start:end] = block.Variables(position).ValuesAsNumpy()
+
+    # Build the dates once if every location covers the same period, otherwise fill them in location by location
+    if len(set(spans)) == 1:
+        dates = np.tile(_response_times(blocks[0], resolution, unit, utc_offsets[0]), len(blocks))
+    else:
+        dates = np.empty(offsets[-1], dtype=unit)
+        for block, utc_offset, start, end in zip(blocks, utc_offsets, offsets[:-1], offsets[1:]):
+            dates[start:end] = _response_times(block, resolution, unit, utc_offset)
+
+    names = [city['city'] for city in geocoded_cities[:len(blocks)]]
+    categories = list(dict.fromkeys(names))
+    codes = np.repeat([categories.index(name) for name in names], lengths)
+
+    # Transposing the values gives pandas the (variables x rows) layout it stores columns in, so no copy is made
+    df = pd.DataFrame(values.T, columns=variables, copy=False)
+    df.insert(0, 'date', dates)
+    df.insert(1, 'city', pd.Categorical.from_codes(codes, categories=categories))
+    return df
+
+# Function for getting and processing the NGRAMS data for a single query
+def get_NGRAMS(query, year_start=1940, year_end=2019, corpus='en-2019', smoothing=3):
+    return get_NGRAMS_batch([query], year_start, year_end, corpus, smoothing)
+
+# Request the NGRAMS timeseries for one batch of phrases.
+# The endpoint accepts several comma separated phrases in one request and returns one timeseries for each phrase it finds.
+def _request_NGRAMS(session, phrases, year_start, year_end, corpus, smoothing, base_url):
+    params = {
+        'content': ','.join(phrases),
+        'year_start': year_start,
+        'year_end': year_end,
+        'corpus': corpus,
+        'smoothing': smoothing,
     }
+    response = session.get(base_url, params=params, timeout=30)
+    response.raise_for_status()
+    return {result['ngram']: result['timeseries'] for result in response.json()}
 
-    # Creating the data frame from all the series
-    daily_data["city"] = geocoded_cities[i]['city']
-    daily_data["temperature_2m_max"] = temperature_2m_max
-    daily_data["temperature_2m_min"] = temperature_2m_min
-    daily_data["temperature_2m_mean"] = temperature_2m_mean
-    daily_data["daylight_duration"] = daylight_duration
-    daily_data["sunshine_duration"] = sunshine_duration
-    daily_data["precipitation_sum"] = precipitation_sum
-    daily_data["rain_sum"] = rain_sum
-    daily_data["precipitation_hours"] = precipitation_hours
+# Function for getting and processing the NGRAMS data for many queries at once.
+# Queries are packed into as few requests as possible, the requests run concurrently over the shared cached session,
+# and the results go straight into one long format dataframe with a row per query and year.
+@perf.timed()
+def get_NGRAMS_batch(queries, year_start=1940, year_end=2019, corpus='en-2019', smoothing=3,
+                     batch_size=12, max_workers=4, session=None, base_url='https://books.google.com/ngrams/json'):
+    queries = list(dict.fromkeys(queries)) # Remove duplicates but keep the order
+    session = session or http_utils.shared_session()
+    batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
 
-    return pd.DataFrame(data=daily_data)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda batch: _request_NGRAMS(session, batch, year_start, year_end, corpus, smoothing, base_url), batches)
+        timeseries = {}
+        for result in results:
+            timeseries.update(result)
 
-# Function for getting and processing the NGRAMS data
-def get_NGRAMS(query):
-    # converting a regular string to  the standard URL format  
-    query_url = urllib.parse.quote(query) 
+    # Fill one array with every timeseries. Queries that don't appear in any books come back empty and are left as 0.
+    years = np.arange(year_start, year_end + 1)
+    appearances = np.zeros((len(queries), len(years)))
+    for i, query in enumerate(queries):
+        values = timeseries.get(query, [])[:len(years)]
+        appearances[i, :len(values)] = values
 
-    # creating the URL 
-    url = 'https://books.google.com/ngrams/json?content=' + query_url +'&year_start=1940&corpus=en-2019&smoothing=3' 
-    response = requests.get(url) 
+    return pd.DataFrame({
+        'query': np.repeat(np.array(queries, dtype=object), len(years)),
+        'year': np.tile(years, len(queries)),
+        'appearances': appearances.ravel(),
+    })
 
-    # extracting the json data from the response we got 
-    output = response.json()
+# Phrases we look up in Google NGRAMS for each weather perception
+NGRAMS_queries = {
+    'rain': ["London rain", "London Rain", "rainy London", "rain in London", "Rain in London", "raining in London", "Raining in London"],
+    'sun': ["London sun", "London Sun", "sunny London", "sun in London", "Sun in London"],
+    'wind': ["London wind", "London Wind", "windy London", "wind in London", "Wind in London"],
+}
 
+# Build the perception table from the NGRAMS data: the total appearances of each category's phrases every year
+# ({category}_absolute_appearances) and the same relative to the first year ({category}_relative_appearances)
+def perception_from_NGRAMS(NGRAMS_df, queries=NGRAMS_queries):
+    perception_df = None
+    for category, category_queries in queries.items():
+        absolute = f'{category}_absolute_appearances'
+        category_df = NGRAMS_df[NGRAMS_df['query'].isin(category_queries)].groupby('year')['appearances'].sum().reset_index()
+        category_df.rename(columns={'appearances': absolute}, inplace=True)
+        category_df[f'{category}_relative_appearances'] = category_df[absolute] / category_df[absolute].iloc[0]
+        perception_df = category_df if perception_df is None else pd.merge(perception_df, category_df, on='year')
+    return perception_df
 
-    # Extracting the timeseries
-    timeseries = output[0]['timeseries']
-    # Creating a DataFrame with year, value, and query
-    years = list(range(1940, 2020))
-    df_query = pd.DataFrame({'query': query, 'year': years, 'appearances': timeseries})
+# Get the list of the most visited cities in the world from travelness.com
+def get_most_visited_cities(session=None, url="https://travelness.com/most-visited-cities-in-the-world"):
+    from scrapy import Selector
+    session = session or http_utils.shared_session()
+    response = session.get(url, timeout=30)
+    response.raise_for_status()
+    sel = Selector(text=response.text) # Define the selector tool
+    return sel.xpath("//table//tr/td[2]/text()").getall() # Get the list of cities using an xpath selector
 
-    # Displaying the final DataFrame
-    return df_query
+# Queries we send to Google auto suggestions for each city
+suggestion_templates = ["why is {city} so", "why is {city} always"]
 
 # Create a list of stereotypes given by google auto suggestions
-def get_auto_suggestions(city):
+def get_auto_suggestions(city, templates=suggestion_templates, session=None,
+                         base_url="https://www.google.com/complete/search"):
+    session = session or http_utils.shared_session()
     # 'Hong Kong SAR' is a term that emphasizes the administrative characteristic of the city
     # And it is rarely used in everyday life, so in order to suit the Google Auto Suggestions
     # it is changed into 'Hong Kong' in this function
@@ -71,26 +171,45 @@ def get_auto_suggestions(city):
     
     #There are more suggestions about weather in the second query, but some cities have no result in the second one
     #So we use two queries to make the function better
-    queries = [f"why is {adjusted_city} so", f"why is {adjusted_city} always"]
+    queries = [template.format(city=adjusted_city) for template in templates]
     all_suggestions = []
     for query in queries:
-        url = f"https://www.google.com/complete/search?q={query}&client=firefox"
-        response = requests.get(url)
+        try:
+            response = session.get(base_url, params={'q': query, 'client': 'firefox'}, timeout=10)
+        except requests.RequestException:
+            print(f"Fail: {query}")
+            continue
         if response.status_code == 200:
             suggestions = response.json()[1]
             all_suggestions.extend(suggestions)
         else:
             print(f"Fail: {query}")
     return all_suggestions
+
+# Get the auto suggestions for many cities at once.
+# The cities are shared between a pool of workers using the shared cached session, which keeps its connections open,
+# retries failed requests with backoff, caches responses on disk and keeps the requests that do go to Google within its rate limit.
+@perf.timed()
+def collect_auto_suggestions(cities, templates=suggestion_templates, max_workers=8, session=None,
+                             base_url="https://www.google.com/complete/search"):
+    session = session or http_utils.shared_session()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda city: get_auto_suggestions(city, templates, session, base_url), cities)
+        return dict(zip(cities, results))
     
 # Extract the descriptive words of the suggestions and create a dict
-def extract_words(cities):
+@perf.timed()
+def extract_words(cities, **collect_options):
     # Create an empty dictionary
     city_stereotype = {}
 
+    # Get the suggestions for every city concurrently
+    all_suggestions = collect_auto_suggestions(cities, **collect_options)
+
     # Loop over each city to create a dictionary of lists
     for city in cities:
-        suggestions = get_auto_suggestions(city)
+        suggestions = all_suggestions[city]
         stereotype_list = [] # Create an empty list
         for suggestion in suggestions:
             if 'why' in suggestion.lower() and ('so' in suggestion.lower() or 'always' in suggestion.lower()):
@@ -107,6 +226,7 @@ def extract_words(cities):
         city_stereotype[city] = [word.strip() for word in stereotypes.split(',') if word.strip()]
     return city_stereotype
 
+@perf.timed()
 def filter_weather_words(suggestion_dict):
     weather_words = ["sunny", "rainy", "windy", "cloudy", "foggy", "hot", "cold", "stormy", "humid", "dry", "wet"]
     new_dict = {}
@@ -116,10 +236,14 @@ def filter_weather_words(suggestion_dict):
         new_dict[key] = filtered_word_list
     return new_dict
 
+# Words that are highlighted in the word clouds and the colours used for them and for every other word
+cloud_weather_words = frozenset(["sunny", "rainy", "raining", "windy", "cloudy", "foggy", "hot", "cold", "stormy", "humid", "dry", "wet", "hazy"])
+weather_word_color = '#f26d34'
+other_word_color = '#fcd21c'
+
 # Custom color function for word clouds
 def custom_color_func(word, font_size, position, orientation, random_state=None, **kwargs):
-    weather_words = ["sunny", "rainy","raining", "windy", "cloudy", "foggy", "hot", "cold", "stormy", "humid", "dry", "wet", "hazy"]
-    if word.lower() in weather_words:
-        return '#f26d34'
+    if word.lower() in cloud_weather_words:
+        return weather_word_color
     else:
-        return '#fcd21c'
\ No newline at end of file
+        return other_word_color
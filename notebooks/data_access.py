@@ -0,0 +1,501 @@
+# import necessary libraries
+import os
+import re
+import datetime
+import threading
+import urllib.parse
+from collections import OrderedDict
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+import weather_db as wdb
+import weather_store as ws
+import perf
+
+# Path to our database, worked out from this file so it works from the notebooks and the website
+db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'rainy.db')
+
+# Memory budget for cached query results
+cache_size_mb = 64
+
+# Whether weather reads return compact dataframes (float32, categorical city) unless asked otherwise
+compact_frames = os.environ.get('RUBBERDUCKS_COMPACT') == '1'
+
+# Number of connections each engine keeps open for concurrent users
+pool_size = 8
+
+# Where the weather queries run: 'sqlite' reads rainy.db and its rollup tables, 'duckdb' runs the same queries
+# with DuckDB on the columnar weather store in `store_path`
+backend = os.environ.get('RUBBERDUCKS_BACKEND', 'sqlite')
+store_path = ws.store_path
+
+# One engine per database for the whole process, shared by every page and user
+_engines = {}
+_engines_lock = threading.Lock()
+
+# Get the shared engine for a database, creating it the first time it is needed.
+# By default the database is opened read-only, so the website can never change it. Connections are kept in a pool
+# and each one keeps its prepared statements, so queries with bound parameters are only prepared once per connection.
+def get_engine(path=db_path, read_only=True):
+    path = os.path.abspath(path)
+    with _engines_lock:
+        if (path, read_only) not in _engines:
+            if read_only:
+                url = f'sqlite:///file:{urllib.parse.quote(path)}?mode=ro&uri=true'
+            else:
+                url = f'sqlite:///{path}'
+            _engines[(path, read_only)] = create_engine(
+                url,
+                echo=False,
+                poolclass=QueuePool,
+                pool_size=pool_size,
+                connect_args={'check_same_thread': False, 'cached_statements': 256}
+            )
+        return _engines[(path, read_only)]
+
+# Cache of query results that drops the least recently used results once it goes over its memory budget.
+# Results are tagged with the database's modification time and size, and the cache is cleared whenever the
+# database file changes so the pages never show stale data after a rebuild.
+class QueryCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.results = OrderedDict()
+        self.versions = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            self._check_version(key[0], version)
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return self.results[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, df):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        # Results bigger than the whole budget are never cached
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            self._check_version(key[0], version)
+            if key in self.results:
+                self.size -= self.results.pop(key)[1]
+            self.results[key] = (df, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, evicted_bytes) = self.results.popitem(last=False)
+                self.size -= evicted_bytes
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.versions.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.results),
+                'size_mb': round(self.size / 1024**2, 2),
+            }
+
+    # Drop every cached result for a database if it has changed since they were stored
+    def _check_version(self, database, version):
+        if self.versions.get(database) != version:
+            for key in [key for key in self.results if key[0] == database]:
+                self.size -= self.results.pop(key)[1]
+            self.versions[database] = version
+
+_cache = QueryCache(cache_size_mb * 1024**2)
+
+# Collapse whitespace and drop the trailing semicolon outside of quoted strings, so the same query
+# written with different formatting shares a cache entry
+def _normalise_sql(query):
+    parts = re.split(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""", query)
+    for i in range(0, len(parts), 2):
+        parts[i] = ' '.join(parts[i].split())
+    return ''.join(parts).strip().rstrip(';').strip()
+
+# Version of a database file, which changes whenever the file is rewritten
+def db_version(engine):
+    database = engine.url.database
+    # Read-only engines use a 'file:' URI for the database
+    if database and database.startswith('file:'):
+        database = urllib.parse.unquote(database[len('file:'):])
+    try:
+        stat = os.stat(database)
+    except (OSError, TypeError):
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Return a copy of the stored result of a query on the current version of a database, running it if there isn't one
+def _cached(database, version, query, params, run):
+    key = (database, _normalise_sql(query), tuple(sorted((params or {}).items())))
+    df = _cache.get(key, version)
+    if df is None:
+        df = run()
+        _cache.put(key, version, df)
+    return df.copy()
+
+# Run a query, or return a copy of the stored result if the same query has already been run on the current database
+def read_sql(query, engine=None, params=None):
+    engine = engine or get_engine()
+
+    def run():
+        with perf.span('read_sql'):
+            return pd.read_sql(query, engine, params=params)
+    return _cached(str(engine.url), db_version(engine), query, params, run)
+
+# Run a query with DuckDB on the columnar weather store, caching the result the same way as read_sql()
+def read_duckdb(query, params=None, path=None):
+    import duckdb_backend
+    path = os.path.abspath(path or store_path)
+
+    def run():
+        with perf.span('read_duckdb'):
+            return duckdb_backend.execute(query, params, path)
+    return _cached(f'duckdb:{path}', duckdb_backend.store_version(path), query, params, run)
+
+# Version of whatever the weather queries currently read from, for caching anything built from their results
+def data_version(engine=None):
+    if backend == 'duckdb':
+        import duckdb_backend
+        return duckdb_backend.store_version(store_path)
+    return db_version(engine or get_engine())
+
+# Hit, miss and eviction counts for the query cache
+def cache_stats():
+    return _cache.stats()
+
+# Empty the query cache
+def clear_cache():
+    _cache.clear()
+
+# Column names can't be passed as query parameters, so only accept the weather variables we know about
+def _check_columns(columns, known=wdb.weather_variables):
+    unknown = [column for column in columns if column not in known]
+    if unknown:
+        raise ValueError(f"Unknown weather variables: {unknown}")
+
+# Build a `column IN (...)` condition with one bound parameter per value.
+# SQLite parameters are marked with ':' and DuckDB parameters with '$'.
+def _in_clause(column, values, marker=':'):
+    params = {f'{column}{i}': value for i, value in enumerate(values)}
+    return f"{column} IN ({', '.join(marker + name for name in params)})", params
+
+# DuckDB compares dates with dates rather than strings
+def _as_date(value):
+    return pd.Timestamp(value).date()
+
+# Read the daily weather for some cities between two dates (inclusive) in one query.
+# Returns a long table indexed by date with a row per city and day.
+def fetch_cities_range(cities, start, end, columns, engine=None):
+    _check_columns(columns)
+    if backend == 'duckdb':
+        where, params = _in_clause('city', cities, '$')
+        query = f"""
+            SELECT date, {', '.join(['city'] + columns)}
+            FROM weather
+            WHERE {where}
+            AND date BETWEEN $start AND $end
+            ORDER BY city, date;
+        """
+        df = read_duckdb(query, dict(params, start=_as_date(start), end=_as_date(end)))
+        df['date'] = pd.to_datetime(df['date']).astype('datetime64[ns]')
+        df[columns] = df[columns].astype('float64')
+        return df.set_index('date')
+
+    where, params = _in_clause('city', cities)
+    query = f"""
+        SELECT date, {', '.join(['city'] + columns)}
+        FROM weather
+        WHERE {where}
+        AND date BETWEEN :start AND :end
+        ORDER BY city, date;
+    """
+    df = read_sql(query, engine, dict(params, start=str(start), end=str(end)))
+    df['date'] = pd.to_datetime(df['date'])
+    df.set_index('date', inplace=True)
+    return df
+
+# Read the daily weather for a city between two dates (inclusive), indexed by date
+def fetch_range(city, start, end, columns, engine=None):
+    return fetch_cities_range([city], start, end, columns, engine).drop(columns='city')
+
+# Yearly totals (stat='sum'), means ('mean') or day counts ('count') of some variables for each city,
+# read from the yearly summary table. Years are returned as 'YYYY' strings.
+def fetch_yearly(columns, cities=None, stat='sum', engine=None):
+    _check_columns(columns)
+    if stat not in ['sum', 'mean', 'count']:
+        raise ValueError(f"Unknown statistic: {stat}")
+
+    if backend == 'duckdb':
+        where, params = _in_clause('city', cities, '$') if cities else ('1 = 1', {})
+        aggregate = {'sum': 'SUM', 'mean': 'AVG', 'count': 'COUNT'}[stat]
+        query = f"""
+            SELECT CAST(year(date) AS VARCHAR) AS year, city, {', '.join(f'{aggregate}({column}) AS {column}' for column in columns)}
+            FROM weather
+            WHERE {where}
+            GROUP BY year, city
+            ORDER BY year, city;
+        """
+        return read_duckdb(query, params)
+
+    where, params = _in_clause('city', cities) if cities else ('1 = 1', {})
+    query = f"""
+        SELECT strftime('%Y', period_start) AS year, city, {', '.join(f'{column}_{stat} AS {column}' for column in columns)}
+        FROM weather_yearly
+        WHERE {where}
+        ORDER BY year, city;
+    """
+    return read_sql(query, engine, params)
+
+# Average daily value of some variables for each city over all the years we have, worked out from the yearly summary table
+def fetch_city_averages(columns, cities=None, engine=None):
+    _check_columns(columns)
+    if backend == 'duckdb':
+        where, params = _in_clause('city', cities, '$') if cities else ('1 = 1', {})
+        query = f"""
+            SELECT city, {', '.join(f'AVG({column}) AS {column}' for column in columns)}
+            FROM weather
+            WHERE {where}
+            GROUP BY city
+            ORDER BY city;
+        """
+        return read_duckdb(query, params)
+
+    where, params = _in_clause('city', cities) if cities else ('1 = 1', {})
+    query = f"""
+        SELECT city, {', '.join(f'SUM({column}_sum) / SUM({column}_count) AS {column}' for column in columns)}
+        FROM weather_yearly
+        WHERE {where}
+        GROUP BY city
+        ORDER BY city;
+    """
+    return read_sql(query, engine, params)
+
+# Whether rainy.db has the rollup tables built from the hourly weather, which are only there if it was collected
+def has_hourly_rollups(engine=None):
+    query = "SELECT name FROM sqlite_master WHERE type = 'table';"
+    tables = set(read_sql(query, engine)['name'])
+    return all(table in tables for table in wdb.hourly_rollup_tables)
+
+# Mean of some hourly variables and the share of hours that were wet for each city and hour of the day (local time),
+# over the years from start_year to end_year (inclusive). The hourly rollups are only kept in rainy.db, so this
+# reads them from there whichever backend is in use.
+def fetch_hour_of_day(columns, cities=None, start_year=None, end_year=None, engine=None):
+    _check_columns(columns, wdb.hourly_variables)
+    where, params = _in_clause('city', cities) if cities else ('1 = 1', {})
+    if start_year is not None:
+        where += " AND year >= :start_year"
+        params['start_year'] = int(start_year)
+    if end_year is not None:
+        where += " AND year <= :end_year"
+        params['end_year'] = int(end_year)
+
+    means = ''.join(f", SUM({column}_sum) / SUM({column}_count) AS {column}" for column in columns)
+    query = f"""
+        SELECT city, hour, 1.0 * SUM(wet_hours) / SUM(hours) AS wet_share{means}
+        FROM weather_hour_of_day
+        WHERE {where}
+        GROUP BY city, hour
+        ORDER BY city, hour;
+    """
+    return read_sql(query, engine, params)
+
+# Average number of wet hours a day for each city, in the whole day and in commuting hours, between two dates
+# (inclusive), from the daily summary of the hourly weather in rainy.db
+def fetch_wet_hours(cities=None, start=None, end=None, engine=None):
+    where, params = _in_clause('city', cities) if cities else ('1 = 1', {})
+    if start is not None:
+        where += " AND date >= :start"
+        params['start'] = str(start)
+    if end is not None:
+        where += " AND date <= :end"
+        params['end'] = str(end)
+
+    query = f"""
+        SELECT city, AVG(wet_hours) AS wet_hours, AVG(wet_commute_hours) AS wet_commute_hours
+        FROM weather_hourly_daily
+        WHERE {where}
+        GROUP BY city
+        ORDER BY wet_hours DESC;
+    """
+    return read_sql(query, engine, params)
+
+# Pandas frequency used to label each period by its last day, matching df.resample(...).mean()
+freq_dict = {
+    'Monthly': 'ME',
+    'Yearly': 'YE',
+    '5 Yearly': '5YE'
+}
+
+# Split a date range into pieces that can each be read from the coarsest table covering them exactly.
+# Whole periods come from the first table in the list and the leftover days at either edge are split up
+# using the remaining (finer) tables, ending with the daily weather table.
+def _split_range(start, end, tables):
+    if start > end:
+        return []
+    if not tables:
+        return [('weather', start, end)]
+
+    table = tables[0]
+    first_start, first_end = wdb.period_bounds(table, start)
+    last_start, last_end = wdb.period_bounds(table, end)
+
+    # Find the first and last days of the whole periods inside the range
+    full_start = start if first_start == start else first_end + datetime.timedelta(days=1)
+    full_end = end if last_end == end else last_start - datetime.timedelta(days=1)
+
+    if full_start > full_end:
+        return _split_range(start, end, tables[1:])
+
+    return (
+        _split_range(start, full_start - datetime.timedelta(days=1), tables[1:]) +
+        [(table, full_start, full_end)] +
+        _split_range(full_end + datetime.timedelta(days=1), end, tables[1:])
+    )
+
+# Label each row with the last day of the period it belongs to in the resampled output
+def _period_labels(dates, frequency, start):
+    if frequency == 'Monthly':
+        return dates + pd.offsets.MonthEnd(0)
+    years = dates.dt.year
+    if frequency == '5 Yearly':
+        # pandas starts the 5 year bins from the first year in the range
+        years = years + (start.year - years) % 5
+    return pd.to_datetime(years.astype(str) + '-12-31')
+
+# Read the daily weather for some cities, resampled to the selected frequency, with one query for all of them.
+# Returns a long table indexed by date with a city column and a row per city and period.
+# Anything other than daily data is built from the rollup tables, topped up with daily rows for
+# any partial periods at the edges of the range, so it gives the same result as resampling the daily data.
+def read_weather_cities(engine, cities, start, end, columns, frequency, compact=None):
+    engine = engine or get_engine()
+    compact = compact_frames if compact is None else compact
+
+    if frequency == 'Daily':
+        df = fetch_cities_range(cities, start, end, columns, engine)
+        return wdb.compact_weather(df) if compact else df
+
+    _check_columns(columns)
+    if not columns:
+        # Nothing to average, so just list every period in the range for each city
+        labels = _period_labels(pd.Series(pd.to_datetime([start, end])), frequency, start)
+        periods = pd.date_range(labels.iloc[0], labels.iloc[1], freq=freq_dict[frequency], name='date')
+        index = pd.MultiIndex.from_product([list(cities), periods], names=['city', 'date'])
+        return pd.DataFrame(index=index).reset_index('city')
+
+    if backend == 'duckdb':
+        means = _duckdb_period_means(cities, start, end, columns, frequency)
+    else:
+        means = _sqlite_period_means(engine, cities, start, end, columns, frequency)
+
+    result = pd.DataFrame(index=pd.DatetimeIndex([], name='date'))
+    if means.empty:
+        return result.reindex(columns=['city'] + columns)
+
+    # Every city gets the same periods, with gaps where it has no data
+    with perf.span('fill_periods'):
+        labels = means.index.get_level_values('date')
+        periods = pd.date_range(labels.min(), labels.max(), freq=freq_dict[frequency], name='date')
+        found = set(means.index.get_level_values('city'))
+        index = pd.MultiIndex.from_product([[city for city in cities if city in found], periods], names=['city', 'date'])
+        result = means.reindex(index).reset_index('city')
+    return wdb.compact_weather(result) if compact else result
+
+# Mean of each variable for every city and period, indexed by city and the last day of the period, from rainy.db
+def _sqlite_period_means(engine, cities, start, end, columns, frequency):
+    # Only use rollups whose periods sit entirely inside one output period
+    if frequency == 'Monthly':
+        tables = ['weather_monthly']
+    elif frequency == 'Yearly':
+        tables = ['weather_yearly', 'weather_monthly']
+    elif start.year % 5 == 0:
+        tables = ['weather_5yearly', 'weather_yearly', 'weather_monthly']
+    else:
+        tables = ['weather_yearly', 'weather_monthly']
+
+    # Build one query that reads the sum and count of each variable for every city and piece of the range
+    where, params = _in_clause('city', cities)
+    selects = []
+    for i, (table, piece_start, piece_end) in enumerate(_split_range(start, end, tables)):
+        params[f'start{i}'] = piece_start.isoformat()
+        params[f'end{i}'] = piece_end.isoformat()
+        if table == 'weather':
+            values = [f"{column} AS {column}_sum, ({column} IS NOT NULL) AS {column}_count" for column in columns]
+            selects.append(f"""
+                SELECT {', '.join(['city', 'date'] + values)}
+                FROM weather
+                WHERE {where}
+                AND date BETWEEN :start{i} AND :end{i}
+            """)
+        else:
+            values = [f"{column}_sum, {column}_count" for column in columns]
+            selects.append(f"""
+                SELECT {', '.join(['city', 'period_start AS date'] + values)}
+                FROM {table}
+                WHERE {where}
+                AND period_start >= :start{i}
+                AND period_end <= :end{i}
+            """)
+
+    df = read_sql(' UNION ALL '.join(selects) + ';', engine, params)
+    df['date'] = pd.to_datetime(df['date'])
+
+    # Combine the pieces of every city into periods in one groupby and turn the sums and counts back into means
+    with perf.span('combine_periods'):
+        labels = _period_labels(df['date'], frequency, start).rename('date')
+        totals = df.drop(columns='date').groupby(['city', labels]).sum()
+        means = pd.DataFrame(index=totals.index)
+        for column in columns:
+            counts = totals[f"{column}_count"]
+            means[column] = totals[f"{column}_sum"] / counts.where(counts > 0)
+    return means
+
+# SQL for the last day of the period each row belongs to, matching _period_labels()
+_duckdb_period_labels = {
+    'Monthly': "last_day(date)",
+    'Yearly': "make_date(year(date), 12, 31)",
+    # DuckDB's % keeps the sign of the left side, so 5 is added to always get a positive remainder
+    '5 Yearly': "make_date(year(date) + (($first_year - year(date)) % 5 + 5) % 5, 12, 31)",
+}
+
+# Mean of each variable for every city and period, indexed by city and the last day of the period, worked out by
+# DuckDB straight from the daily data in the columnar store
+def _duckdb_period_means(cities, start, end, columns, frequency):
+    where, params = _in_clause('city', cities, '$')
+    params.update(start=_as_date(start), end=_as_date(end))
+    if frequency == '5 Yearly':
+        params['first_year'] = _as_date(start).year
+
+    query = f"""
+        SELECT city, {_duckdb_period_labels[frequency]} AS date, {', '.join(f'AVG({column}) AS {column}' for column in columns)}
+        FROM weather
+        WHERE {where}
+        AND date BETWEEN $start AND $end
+        GROUP BY city, 2;
+    """
+    df = read_duckdb(query, params)
+    df['date'] = pd.to_datetime(df['date']).astype('datetime64[ns]')
+    return df.set_index(['city', 'date'])[columns].astype('float64')
+
+# Read the daily weather for a city, resampled to the selected frequency
+def read_weather(engine, city, start, end, columns, frequency, compact=None):
+    return read_weather_cities(engine, [city], start, end, columns, frequency, compact).drop(columns='city')
+
+# Turn a long table from read_weather_cities() into a wide one with a column for every variable and city
+def to_wide(df):
+    wide = df.pivot(columns='city')
+    wide.columns = [f'{city} {column}' for column, city in wide.columns]
+    return wide
@@ -0,0 +1,58 @@
+# Run queries with DuckDB, an in-process columnar database, straight on the columnar weather store instead of rainy.db.
+# The store's Arrow files are memory mapped and handed to DuckDB without copying, and DuckDB scans only the columns a
+# query uses, in parallel, so aggregations over the whole dataset don't need any rollup tables.
+# data_access uses this when RUBBERDUCKS_BACKEND=duckdb; nothing here is cached, that is left to data_access.
+
+# import necessary libraries
+import os
+import glob
+import queue
+import threading
+import duckdb
+import weather_store as ws
+
+# Number of DuckDB connections kept for each store, so that several users can run queries at the same time
+pool_size = 4
+
+# Connection pool for each store, along with the version of the store it was made from
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Version of the store, which changes whenever any of its files is rewritten
+def store_version(path=ws.store_path):
+    files = glob.glob(os.path.join(path, '*'))
+    if not files:
+        return None
+    stats = [os.stat(file) for file in files]
+    return (len(stats), max(stat.st_mtime_ns for stat in stats), sum(stat.st_size for stat in stats))
+
+# Open a DuckDB connection with the whole store as its `weather` view. The city is turned from Arrow's dictionary
+# encoding into plain text so it compares and groups like the city column in rainy.db.
+def _connect(table):
+    connection = duckdb.connect()
+    connection.register('weather_arrow', table)
+    connection.execute("CREATE VIEW weather AS SELECT * REPLACE (CAST(city AS VARCHAR) AS city) FROM weather_arrow;")
+    return connection
+
+# Get the connection pool for a store, rebuilding it if the store has changed since it was made
+def _pool(path):
+    path = os.path.abspath(path)
+    version = store_version(path)
+    with _pools_lock:
+        if path not in _pools or _pools[path][0] != version:
+            table = ws.read_weather_table(path)
+            connections = queue.Queue()
+            for _ in range(pool_size):
+                connections.put(_connect(table))
+            _pools[path] = (version, connections)
+        return _pools[path][1]
+
+# Run a query on the store with named ($name) parameters and return the result as a dataframe.
+# Each query borrows a connection from the pool, waiting for one if they are all busy.
+def execute(query, params=None, path=ws.store_path):
+    connections = _pool(path)
+    connection = connections.get()
+    try:
+        return connection.execute(query, params or {}).df()
+    finally:
+        connections.put(connection)
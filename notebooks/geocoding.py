@@ -0,0 +1,136 @@
+# import necessary libraries
+import os
+import json
+import time
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from geopy.geocoders import Nominatim
+from geopy.adapters import RequestsAdapter
+from geopy.exc import GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable
+import http_utils
+
+# File where geocoded cities are saved between runs
+cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'geocode_cache.json')
+
+# Turn a city name into the key used in the cache so 'London', ' london ' and 'LONDON' share an entry
+def normalise_city(city):
+    return ' '.join(unicodedata.normalize('NFKC', city).casefold().split())
+
+# Geocoded cities saved to a JSON file, keyed on the normalised city name.
+# Cities the geocoder couldn't find are stored as None so they aren't looked up again either.
+class GeocodeCache:
+    def __init__(self, path=cache_path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+
+    def __contains__(self, city):
+        return normalise_city(city) in self.entries
+
+    # Look up a city, counting the hit or miss
+    def get(self, city):
+        key = normalise_city(city)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, city, result):
+        with self.lock:
+            self.entries[normalise_city(city)] = result
+
+    # Write the cache to disk, going through a temporary file so a crash can't leave it half written
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(self.path + '.tmp', self.path)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+# geopy adapter that sends the geocoder's requests through the shared cached session, so Nominatim responses are
+# recorded and replayed like every other collector's
+class CachedSessionAdapter(RequestsAdapter):
+    def __init__(self, *, proxies=None, ssl_context=None, **kwargs):
+        super().__init__(proxies=proxies, ssl_context=ssl_context, **kwargs)
+        self.session.close()
+        self.session = http_utils.shared_session()
+
+    # The shared session outlives the geocoder, so it mustn't be closed with it
+    def __del__(self):
+        pass
+
+# Nominatim geocoder using the shared cached session
+def cached_nominatim(user_agent="my_geocoder"):
+    return Nominatim(user_agent=user_agent, adapter_factory=CachedSessionAdapter)
+
+# Geocode a single city, retrying with a growing wait if the geocoder times out or is unavailable
+def geocode_city(city, geocoder, retries=3, backoff_factor=1):
+    for attempt in range(retries + 1):
+        try:
+            location = geocoder.geocode(city)
+            break
+        except (GeocoderTimedOut, GeocoderUnavailable):
+            if attempt == retries:
+                raise
+            time.sleep(backoff_factor * 2 ** attempt)
+
+    if location is None:
+        return None
+    return {"city": city, "latitude": location.latitude, "longitude": location.longitude}
+
+# Geocode a list of cities, looking each one up once at most.
+# Cities already in the cache are returned straight away and the rest are shared between a pool of workers.
+# The shared session keeps the requests that go to the network within Nominatim's rate limit (one a second), while
+# responses from the HTTP cache, or replayed offline, come straight back.
+# Any object with a geocode(query) method that returns something with a latitude and longitude can be used as
+# the geocoder, e.g. a local stand-in while testing.
+def geocode_cities(cities, geocoder=None, cache=None, max_workers=4):
+    geocoder = geocoder or cached_nominatim()
+    cache = GeocodeCache() if cache is None else cache
+
+    # Each distinct city that isn't in the cache yet only needs to be looked up once
+    to_lookup = {}
+    for city in cities:
+        if cache.get(city) is None and city not in cache:
+            to_lookup.setdefault(normalise_city(city), city)
+
+    # A city that fails is left out of the cache (so it is tried again next time) rather than stopping the others
+    def lookup(city):
+        try:
+            return geocode_city(city, geocoder), None
+        except GeocoderServiceError as error:
+            return None, error
+
+    # Whatever has been looked up is saved even if the run is interrupted part way through,
+    # in which case the lookups that haven't started yet are cancelled
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for city, (result, error) in zip(to_lookup.values(), executor.map(lookup, to_lookup.values())):
+            if error is not None:
+                print(f"Couldn't geocode {city}: {error}")
+            else:
+                cache.put(city, result)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        cache.save()
+
+    # Return the cities in their original order under the names they were given as, leaving out any that weren't found
+    geocoded_cities = []
+    for city in cities:
+        result = cache.entries.get(normalise_city(city))
+        if result is not None:
+            geocoded_cities.append({**result, "city": city})
+    return geocoded_cities
@@ -0,0 +1,172 @@
+# import necessary libraries
+import os
+import time
+import threading
+import urllib.parse
+import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+# Folder for the on-disk cache of every response the collectors get
+http_cache_path = os.environ.get('RUBBERDUCKS_HTTP_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'http'))
+
+# Largest size the response cache may grow to before the oldest responses are removed
+http_cache_max_mb = int(os.environ.get('RUBBERDUCKS_HTTP_CACHE_MB', 500))
+
+# 'record' sends requests for anything that isn't cached (or has expired) and saves the responses.
+# 'replay' never touches the network and answers every request from the cache, even if the response has expired,
+# so the whole collection pipeline can run offline from a recorded cache.
+http_mode = os.environ.get('RUBBERDUCKS_HTTP_MODE', 'record')
+
+# How long the responses of each endpoint are kept before they are fetched again (-1 keeps them forever).
+# Historical weather and coordinates don't change, while the lists and suggestions slowly do.
+endpoint_ttls = {
+    'archive-api.open-meteo.com': -1,
+    'nominatim.openstreetmap.org': -1,
+    'books.google.com/ngrams': 30 * 24 * 3600,
+    'travelness.com': 7 * 24 * 3600,
+    'www.google.com/complete/search': 24 * 3600,
+}
+
+# Most requests a second each site allows. Only requests that go to the network count, not ones answered from the cache.
+endpoint_rates = {
+    'nominatim.openstreetmap.org': 1,
+    'www.google.com': 5,
+}
+
+# Spaces out calls made from any number of threads so there are at most `calls_per_second` of them each second.
+# Used to keep within the usage policies of the APIs we collect from.
+class RateLimiter:
+    def __init__(self, calls_per_second):
+        self.interval = 1 / calls_per_second if calls_per_second else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    # Block until the next call is allowed
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+# Transport that retries failed requests and keeps to the request rate of each site in `rates`.
+# The retries are made here rather than inside urllib3 so every attempt, not just the first, waits its turn with the
+# rate limiter, and a Retry-After header sent with a 429 or 503 is waited out before trying again.
+class RateLimitedAdapter(HTTPAdapter):
+    def __init__(self, rates=None, retry=None, **kwargs):
+        super().__init__(**kwargs)
+        self.retry = retry or Retry(0, read=False)
+        self.rate_limiters = {host: RateLimiter(calls_per_second) for host, calls_per_second in (rates or {}).items()}
+
+    def send(self, request, **kwargs):
+        rate_limiter = self.rate_limiters.get(urllib.parse.urlsplit(request.url).hostname)
+        retry = self.retry
+        while True:
+            if rate_limiter:
+                rate_limiter.wait()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                try:
+                    retry = retry.increment(request.method, request.url, error=error)
+                except MaxRetryError:
+                    raise error
+                retry.sleep()
+                continue
+
+            if not retry.is_retry(request.method, response.status_code, 'Retry-After' in response.headers):
+                return response
+            try:
+                retry = retry.increment(request.method, request.url, response=response.raw)
+            except MaxRetryError as error:
+                raise requests.exceptions.RetryError(error, request=request)
+            response.close()
+            retry.sleep(response.raw)
+
+# Transport used in replay mode: any request that isn't answered from the cache fails instead of going to the network
+class OfflineAdapter(HTTPAdapter):
+    def send(self, request, **kwargs):
+        raise requests.ConnectionError(f"Replaying from the response cache and no response was recorded for {request.url}")
+
+# Remove the oldest responses from a cache folder until it is under `max_bytes`
+def trim_cache(cache_name=http_cache_path, max_bytes=None):
+    max_bytes = http_cache_max_mb * 1024**2 if max_bytes is None else max_bytes
+    files = []
+    for directory, _, names in os.walk(cache_name):
+        for name in names:
+            # The index of redirects is small and shared by every response
+            if name.endswith('.sqlite'):
+                continue
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    size = sum(file_size for _, file_size, _ in files)
+    removed = 0
+    for _, file_size, path in sorted(files):
+        if size <= max_bytes:
+            break
+        os.remove(path)
+        size -= file_size
+        removed += 1
+    return removed
+
+# Cache folders that have already been pruned by this process
+_pruned_caches = set()
+_pruned_caches_lock = threading.Lock()
+
+# Delete the expired responses of a session's cache and trim it to `max_bytes`, only the first time a session is made
+# for that cache in this process. Sessions made at the same time (like the pipeline's concurrent stages) wait for
+# the first one to finish pruning rather than pruning the same cache under each other.
+def _prune_once(session, cache_name, max_bytes):
+    with _pruned_caches_lock:
+        key = os.path.abspath(cache_name)
+        if key in _pruned_caches:
+            return
+        session.cache.delete(expired=True)
+        trim_cache(cache_name, max_bytes)
+        _pruned_caches.add(key)
+
+# Create a session that answers requests from the on-disk response cache, with a lifetime for each endpoint's
+# responses (endpoint_ttls). In 'record' mode anything missing or expired is fetched, retrying failures with
+# backoff and keeping to each site's request rate (endpoint_rates), and the cache is pruned to its size cap once per
+# process. In 'replay' mode nothing is fetched.
+def cached_session(pool_size=10, retries=3, backoff_factor=0.5, cache_name=http_cache_path, mode=None, max_mb=None):
+    mode = mode or http_mode
+    if mode not in ['record', 'replay']:
+        raise ValueError(f"Unknown HTTP cache mode: {mode}")
+
+    session = requests_cache.CachedSession(
+        cache_name,
+        backend='filesystem',
+        expire_after=-1,
+        urls_expire_after=endpoint_ttls,
+        allowable_methods=['GET', 'POST'],
+        # Expired responses are still used when replaying, as the request to refresh them always fails
+        stale_if_error=mode == 'replay',
+    )
+
+    if mode == 'replay':
+        adapter = OfflineAdapter()
+    else:
+        _prune_once(session, cache_name, (http_cache_max_mb if max_mb is None else max_mb) * 1024**2)
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET', 'POST'])
+        adapter = RateLimitedAdapter(endpoint_rates, retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# One cached session for the whole process, shared by every collector that isn't given its own
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+def shared_session():
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = cached_session()
+        return _shared_session
@@ -0,0 +1,95 @@
+# import necessary libraries
+import datetime
+from sqlalchemy import text
+import custom_functions as cf
+import weather_db as wdb
+import weather_store as ws
+
+# The open-meteo historical weather API and the first date it has data for
+archive_url = "https://archive-api.open-meteo.com/v1/archive"
+first_date = datetime.date(1940, 1, 1)
+
+# Find the last date with data for each city in the database.
+# Days at the end that came back empty (the archive lags a few days behind) don't count, so they are fetched again next time.
+def latest_dates(engine):
+    query = """
+        SELECT city, MAX(date) AS latest_date
+        FROM weather
+        WHERE temperature_2m_mean IS NOT NULL
+        GROUP BY city;
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(text(query)).fetchall()
+    return {city: datetime.date.fromisoformat(latest_date) for city, latest_date in rows}
+
+# Work out the date range each city needs, grouping cities that need the same range so they can share a request.
+# New cities start from the beginning of the archive and cities that are already up to date are left out.
+def plan_updates(geocoded_cities, latest, end_date):
+    plan = {}
+    for city in geocoded_cities:
+        if city['city'] in latest:
+            start_date = latest[city['city']] + datetime.timedelta(days=1)
+        else:
+            start_date = first_date
+        if start_date <= end_date:
+            plan.setdefault(start_date, []).append(city)
+    return plan
+
+# Number of locations requested from the api at once by default
+chunk_size = 5
+
+# Download the weather for many locations a few at a time and write each chunk straight into the database (in its own
+# transaction, replacing any rows already stored for the same city and date) and/or the weather store before the next
+# chunk is requested. Only one chunk's responses and dataframe are ever held, so the memory needed stays the same
+# however many locations there are. Returns the cities that were written.
+# With resolution='hourly' the hourly `variables` are requested in each city's own time zone and kept in compact
+# form. Hourly weather only goes to the store (such as ws.hourly_store_path), as rainy.db only has its rollups.
+def stream_weather(client, geocoded_cities, start_date, end_date, engine=None, store_path=None, chunk_size=chunk_size,
+                   variables=wdb.weather_variables, resolution='daily'):
+    if resolution == 'hourly' and engine is not None:
+        raise ValueError("Hourly weather is only kept in the weather store, use weather_db.build_hourly_rollups() to add it to the database")
+    if engine is not None:
+        wdb.create_schema(engine)
+
+    written_cities = []
+    for i in range(0, len(geocoded_cities), chunk_size):
+        cities = geocoded_cities[i:i + chunk_size]
+        params = {
+            "latitude": [city["latitude"] for city in cities],
+            "longitude": [city["longitude"] for city in cities],
+            "start_date": str(start_date),
+            "end_date": str(end_date),
+            resolution: variables,
+        }
+        if resolution == 'hourly':
+            params["timezone"] = "auto"
+        responses = client.weather_api(archive_url, params=params)
+        chunk_df = cf.process_responses(responses, cities, variables, resolution, compact=resolution == 'hourly')
+        del responses
+
+        if engine is not None:
+            with engine.begin() as conn:
+                wdb.insert_weather(chunk_df, conn)
+        if store_path is not None:
+            ws.append_weather_store(chunk_df, store_path, resolution)
+        del chunk_df
+
+        written_cities.extend(city['city'] for city in cities)
+        print(f"Written {len(written_cities)} of {len(geocoded_cities)} locations")
+    return written_cities
+
+# Only fetch the weather that is missing from the database and add it to the database, the weather store and the rollups.
+# The cities that need the same dates are fetched and written a chunk at a time. Returns the cities that were updated.
+def ingest_incremental(client, geocoded_cities, engine, end_date=None, store_path=ws.store_path, chunk_size=chunk_size):
+    end_date = end_date or datetime.date.today() - datetime.timedelta(days=1)
+    wdb.create_schema(engine)
+
+    updated_cities = []
+    for start_date, cities in plan_updates(geocoded_cities, latest_dates(engine), end_date).items():
+        written_cities = stream_weather(client, cities, start_date, end_date, engine, store_path, chunk_size)
+
+        # Only the rollup periods from the start of the new data onwards need rebuilding
+        wdb.refresh_rollups(engine, written_cities, since=start_date)
+        updated_cities.extend(written_cities)
+
+    return updated_cities
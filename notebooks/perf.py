@@ -0,0 +1,151 @@
+# Lightweight timing spans for the slow parts of the data pipeline and the website.
+# Timing is switched on by setting RUBBERDUCKS_PERF=1. When it is off, span() hands back one shared do-nothing
+# context manager and timed() leaves functions undecorated, so the instrumented code runs as if it wasn't there.
+#
+# Every span is added to a histogram for the whole process, which is written to `histogram_path` on exit (or with
+# export_histograms()), and to the ring buffer of the current website session if one is bound to the running thread.
+
+# import necessary libraries
+import os
+import json
+import time
+import atexit
+import bisect
+import functools
+import threading
+import contextlib
+from collections import deque
+
+enabled = os.environ.get('RUBBERDUCKS_PERF') == '1'
+
+# Number of spans each website session keeps
+ring_size = 500
+
+# Where the histograms are written to
+histogram_path = os.environ.get('RUBBERDUCKS_PERF_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'perf_histograms.json'))
+
+# Upper edges of the histogram buckets in milliseconds, roughly doubling from 0.1ms to 100s. Anything slower goes in a last bucket.
+bucket_edges_ms = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000]
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+_local = threading.local()
+_null_span = contextlib.nullcontext()
+
+# The most recent spans of one website session
+class SpanBuffer:
+    def __init__(self, size=ring_size):
+        self.spans = deque(maxlen=size)
+
+    def add(self, name, seconds):
+        self.spans.append((name, seconds, time.time()))
+
+    # Count, total, mean and slowest time of each span name, in milliseconds
+    def summary(self):
+        summary = {}
+        for name, seconds, _ in self.spans:
+            entry = summary.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            entry['count'] += 1
+            entry['total_ms'] += seconds * 1000
+            entry['max_ms'] = max(entry['max_ms'], seconds * 1000)
+        for entry in summary.values():
+            entry['mean_ms'] = entry['total_ms'] / entry['count']
+        return summary
+
+# Send the spans timed in this thread to a session's buffer (or stop sending them with None)
+def bind(buffer):
+    _local.buffer = buffer
+
+# Add a timing to the histograms and to the bound session buffer
+def record(name, seconds):
+    bucket = bisect.bisect_left(bucket_edges_ms, seconds * 1000)
+    with _histograms_lock:
+        histogram = _histograms.setdefault(name, {'count': 0, 'total_s': 0.0, 'counts': [0] * (len(bucket_edges_ms) + 1)})
+        histogram['count'] += 1
+        histogram['total_s'] += seconds
+        histogram['counts'][bucket] += 1
+
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is not None:
+        buffer.add(name, seconds)
+
+class _Span:
+    __slots__ = ['name', 'start']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+# Time a block of code:
+#   with perf.span('draw'):
+#       fig = g.draw()
+def span(name):
+    return _Span(name) if enabled else _null_span
+
+# Time every call of a function, under its name unless another is given
+def timed(name=None):
+    def decorator(function):
+        if not enabled:
+            return function
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _Span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Write the histograms of every span timed so far as JSON
+def export_histograms(path=None):
+    path = path or histogram_path
+    with _histograms_lock:
+        spans = {name: dict(histogram, counts=list(histogram['counts'])) for name, histogram in _histograms.items()}
+    if not spans:
+        return None
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'bucket_edges_ms': bucket_edges_ms, 'exported': time.time(), 'spans': spans}, f, indent=1)
+    os.replace(path + '.tmp', path)
+    return path
+
+if enabled:
+    atexit.register(export_histograms)
+
+## Website helpers. Streamlit is only imported when these are used, so the notebooks don't need it.
+
+# Call at the top of a page: binds this session's span buffer to the thread running the page and starts timing the rerun
+def start_page():
+    if not enabled:
+        return
+    import streamlit as st
+    if '_perf_buffer' not in st.session_state:
+        st.session_state['_perf_buffer'] = SpanBuffer()
+    bind(st.session_state['_perf_buffer'])
+    _local.page_start = time.perf_counter()
+
+# Call at the bottom of a page: records the whole rerun and shows the collapsible Performance panel
+def show_panel(*cache_stats):
+    if not enabled:
+        return
+    import streamlit as st
+    import pandas as pd
+    record('rerun', time.perf_counter() - _local.page_start)
+
+    with st.expander("Performance", expanded=False):
+        summary = st.session_state['_perf_buffer'].summary()
+        df = pd.DataFrame.from_dict(summary, orient='index', columns=['count', 'mean_ms', 'max_ms', 'total_ms'])
+        st.dataframe(df.sort_values('total_ms', ascending=False).round(2))
+        for name, stats in cache_stats:
+            st.caption(f"{name}: {stats}")
+        if st.button("Export histograms", key='_perf_export'):
+            st.caption(f"Written to {export_histograms()}")
+    bind(None)
@@ -0,0 +1,235 @@
+# Run the data collection pipeline from NB01 from the command line:
+#   cities -> geocode -> weather (Open-Meteo requests, processed into the weather store a few cities at a time)
+#   ngrams (Google NGRAMS perception data)
+#   suggestions (Google auto suggestions)
+#   weather_hourly (with --hourly: hourly Open-Meteo weather, processed into the hourly weather store)
+#   database (rainy.db from the weather store and perception data, and the hourly rollups with --hourly)
+#
+# Every stage records a content hash of its inputs (its settings and input files) and of its outputs in a state file.
+# A stage is skipped when its inputs are unchanged and its outputs are still exactly what it wrote last time.
+# Stages run as soon as the stages they depend on have finished, so the weather, NGRAMS and suggestions stages
+# run at the same time.
+#
+# Usage (from the repository root):
+#   python notebooks/pipeline.py                  # run every stage that is out of date
+#   python notebooks/pipeline.py ngrams database  # only run some stages
+#   python notebooks/pipeline.py --force weather  # rerun a stage even if it is up to date
+#   python notebooks/pipeline.py --hourly         # also collect the hourly weather
+
+# import necessary libraries
+import os
+import sys
+import json
+import hashlib
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Make the other modules in this folder importable when run as a script
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import custom_functions as cf
+
+# Folder the pipeline reads from and writes to
+data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+# File recording the input and output hashes of every stage
+state_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'pipeline_state.json')
+
+# Hash a file, or every file in a folder along with their names. Missing paths hash to None.
+def content_hash(path):
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for directory, _, names in sorted(os.walk(path)):
+            for name in sorted(names):
+                file = os.path.join(directory, name)
+                digest.update(os.path.relpath(file, path).encode())
+                digest.update(content_hash(file).encode())
+        return digest.hexdigest()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# One step of the pipeline: `run(data_dir, settings)` reads the `inputs` files and writes the `outputs` files
+# (both relative to the data folder), after every stage in `after` has finished
+class Stage:
+    def __init__(self, name, run, inputs=(), outputs=(), after=(), settings=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+        self.settings = settings or {}
+
+    def input_hash(self, data_dir):
+        inputs = {
+            'settings': self.settings,
+            'files': {path: content_hash(os.path.join(data_dir, path)) for path in self.inputs},
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+    def output_hashes(self, data_dir):
+        return {path: content_hash(os.path.join(data_dir, path)) for path in self.outputs}
+
+## The stages
+
+def run_cities(data_dir, settings):
+    cities = cf.get_most_visited_cities(url=settings['url'])
+    with open(os.path.join(data_dir, 'cities.json'), 'w') as f:
+        json.dump(cities, f)
+
+def run_geocode(data_dir, settings):
+    import geocoding
+    with open(os.path.join(data_dir, 'cities.json'), 'r') as f:
+        cities = json.load(f)
+    cache = geocoding.GeocodeCache(os.path.join(data_dir, 'geocode_cache.json'))
+    geocoded_cities = geocoding.geocode_cities(cities, cache=cache)
+    with open(os.path.join(data_dir, 'city_coordinates.json'), 'w') as f:
+        json.dump(geocoded_cities, f)
+
+def run_weather(data_dir, settings):
+    import openmeteo_requests
+    import http_utils
+    import ingest
+    with open(os.path.join(data_dir, 'city_coordinates.json'), 'r') as f:
+        geocoded_cities = json.load(f)
+
+    # Written to the store a few cities at a time, so only one chunk of responses is held in memory
+    openmeteo = openmeteo_requests.Client(session=http_utils.cached_session(retries=5, backoff_factor=0.2))
+    ingest.stream_weather(openmeteo, geocoded_cities, settings['start_date'], settings['end_date'],
+                          store_path=os.path.join(data_dir, settings['store']), chunk_size=settings['chunk_size'],
+                          variables=settings['variables'], resolution=settings['resolution'])
+
+def run_ngrams(data_dir, settings):
+    queries = [query for category_queries in settings['queries'].values() for query in category_queries]
+    NGRAMS_df = cf.get_NGRAMS_batch(queries, year_start=settings['year_start'], year_end=settings['year_end'], corpus=settings['corpus'])
+    cf.perception_from_NGRAMS(NGRAMS_df, settings['queries']).to_csv(os.path.join(data_dir, 'perception_data.csv'), index=False)
+
+def run_suggestions(data_dir, settings):
+    with open(os.path.join(data_dir, 'cities.json'), 'r') as f:
+        cities = json.load(f)
+    suggestion_list = cf.extract_words(cities, templates=settings['templates'])
+    with open(os.path.join(data_dir, 'auto_suggestion_words.json'), 'w') as f:
+        json.dump(suggestion_list, f)
+
+def run_database(data_dir, settings):
+    import weather_db as wdb
+    hourly_source = os.path.join(data_dir, 'weather_hourly') if settings['hourly'] else None
+    engine = wdb.build_database(os.path.join(data_dir, 'rainy.db'), os.path.join(data_dir, 'weather'), os.path.join(data_dir, 'perception_data.csv'), hourly_source)
+    engine.dispose()
+
+# The pipeline's stages. With hourly=True the hourly weather is collected too and rainy.db gets the hourly rollups.
+def make_stages(start_date='1940-01-01', end_date='2023-12-31', hourly=False):
+    from weather_db import weather_variables, hourly_variables
+    weather_settings = {'start_date': start_date, 'end_date': end_date, 'chunk_size': 5}
+    database_inputs, database_after = ['weather', 'perception_data.csv'], ['weather', 'ngrams']
+    hourly_stages = []
+    if hourly:
+        hourly_stages.append(Stage('weather_hourly', run_weather, inputs=['city_coordinates.json'], outputs=['weather_hourly'], after=['geocode'],
+                                   settings=dict(weather_settings, variables=hourly_variables, resolution='hourly', store='weather_hourly')))
+        database_inputs.append('weather_hourly')
+        database_after.append('weather_hourly')
+
+    return [
+        Stage('cities', run_cities, outputs=['cities.json'],
+              settings={'url': "https://travelness.com/most-visited-cities-in-the-world"}),
+        Stage('geocode', run_geocode, inputs=['cities.json'], outputs=['city_coordinates.json'], after=['cities']),
+        Stage('weather', run_weather, inputs=['city_coordinates.json'], outputs=['weather'], after=['geocode'],
+              settings=dict(weather_settings, variables=weather_variables, resolution='daily', store='weather')),
+        *hourly_stages,
+        Stage('ngrams', run_ngrams, outputs=['perception_data.csv'],
+              settings={'queries': cf.NGRAMS_queries, 'year_start': 1940, 'year_end': 2019, 'corpus': 'en-2019'}),
+        Stage('suggestions', run_suggestions, inputs=['cities.json'], outputs=['auto_suggestion_words.json'], after=['cities'],
+              settings={'templates': cf.suggestion_templates}),
+        Stage('database', run_database, inputs=database_inputs, outputs=['rainy.db'], after=database_after,
+              settings={'hourly': hourly}),
+    ]
+
+## Running the stages
+
+def _read_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _write_state(state, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+# Run a stage unless its checkpoint shows it is up to date. Returns 'skipped' or 'ran'.
+def run_stage(stage, data_dir, state, state_lock, force=False):
+    input_hash = stage.input_hash(data_dir)
+    with state_lock:
+        checkpoint = state.get(stage.name)
+    if not force and checkpoint and checkpoint['inputs'] == input_hash and checkpoint['outputs'] == stage.output_hashes(data_dir):
+        return 'skipped'
+
+    started = datetime.datetime.now()
+    stage.run(data_dir, stage.settings)
+    with state_lock:
+        state[stage.name] = {
+            'inputs': input_hash,
+            'outputs': stage.output_hashes(data_dir),
+            'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+            'seconds': round((datetime.datetime.now() - started).total_seconds(), 1),
+        }
+    return 'ran'
+
+# Run the selected stages (all of them by default), each one as soon as the selected stages it depends on are done.
+# Stages that depend on a stage that isn't selected assume its outputs are already in place.
+# The state file is saved after every stage, so an interrupted run picks up where it stopped.
+def run_pipeline(selected=None, force=(), data_dir=data_path, state_file=state_path, max_workers=3, stages=None):
+    stages = {stage.name: stage for stage in (stages or make_stages())}
+    selected = list(stages) if not selected else selected
+    unknown = [name for name in list(selected) + list(force) if name not in stages]
+    if unknown:
+        raise ValueError(f"Unknown stages: {unknown}")
+
+    os.makedirs(data_dir, exist_ok=True)
+    state = _read_state(state_file)
+    state_lock = threading.Lock()
+    results = {}
+    pending = {name: [after for after in stages[name].after if after in selected] for name in selected}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name in [name for name, after in pending.items() if all(results.get(stage) for stage in after)]:
+                del pending[name]
+                print(f"[{name}] starting")
+                running[executor.submit(run_stage, stages[name], data_dir, state, state_lock, name in force)] = name
+
+            if not running:
+                raise RuntimeError(f"Stages can't run because of a dependency cycle: {list(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                print(f"[{name}] {results[name]}")
+                with state_lock:
+                    _write_state(state, state_file)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the data collection pipeline, skipping stages that are up to date')
+    parser.add_argument('stages', nargs='*', help='stages to run (default: all of them)')
+    parser.add_argument('--force', nargs='+', default=[], help='stages to rerun even if they are up to date')
+    parser.add_argument('--data-dir', default=data_path, help='folder the data is read from and written to')
+    parser.add_argument('--state-file', default=state_path, help='file the stage checkpoints are kept in')
+    parser.add_argument('--start-date', default='1940-01-01', help='first day of weather data')
+    parser.add_argument('--end-date', default='2023-12-31', help='last day of weather data')
+    parser.add_argument('--workers', type=int, default=3, help='stages that may run at the same time')
+    parser.add_argument('--hourly', action='store_true', help='also collect the hourly weather and build its rollups')
+    args = parser.parse_args()
+
+    run_pipeline(args.stages, args.force, args.data_dir, args.state_file, args.workers, make_stages(args.start_date, args.end_date, args.hourly))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# import necessary libraries
+import io
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+# Resolution figures are rendered at by figure_png(), which the downsampling point budget is worked out from
+default_dpi = 200
+
+# Number of points worth drawing for a figure of the given width in inches: a minimum and a maximum for every pixel column
+def target_points(figure_width, dpi=default_dpi):
+    return 2 * int(figure_width * dpi)
+
+# Pick the rows to keep when downsampling: the x axis is split into one bucket per pixel column and the rows with
+# the smallest and largest value in each bucket are kept, so every peak and trough still shows up in the plot
+def minmax_indices(x, y, n_buckets):
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    if len(x) <= 2 * n_buckets:
+        return np.arange(len(x))
+
+    # Find where each bucket starts (x has to be sorted)
+    edges = np.linspace(x[0], x[-1], n_buckets + 1)[:-1]
+    starts = np.unique(np.searchsorted(x, edges, side='left'))
+    lengths = np.diff(np.r_[starts, len(x)])
+    bucket = np.repeat(np.arange(len(starts)), lengths)
+
+    # Smallest and largest value in each bucket, ignoring missing values
+    keep = []
+    for reduce in [np.fmin, np.fmax]:
+        extremes = np.repeat(reduce.reduceat(y, starts), lengths)
+        matches = np.flatnonzero(y == extremes)
+        # Only keep the first row that matches in each bucket
+        first = np.r_[True, bucket[matches][1:] != bucket[matches][:-1]]
+        keep.append(matches[first])
+
+    return np.unique(np.concatenate(keep))
+
+# Downsample a dataframe with a datetime index to about as many points as the figure can show.
+# Returns the dataframe unchanged if it is already small enough.
+def downsample(df, column, figure_width, dpi=default_dpi):
+    n_buckets = target_points(figure_width, dpi) // 2
+    x = df.index.asi8 if hasattr(df.index, 'asi8') else np.arange(len(df))
+    return df.iloc[minmax_indices(x, df[column], n_buckets)]
+
+# Downsample every group of a long dataframe (for example every city) separately, so each series keeps its own peaks and troughs
+def downsample_groups(df, column, by, figure_width, dpi=default_dpi):
+    if df.empty:
+        return df
+    groups = [downsample(group, column, figure_width, dpi) for _, group in df.groupby(by, sort=False, observed=True)]
+    return pd.concat(groups)
+
+# Cache of rendered figures (image bytes plus a little information about them), keyed on everything that was
+# selected to make them. The least recently used figures are dropped once the cache goes over its memory budget,
+# and if a folder is given every figure is also saved there so they survive restarts.
+class FigureCache:
+    def __init__(self, max_bytes, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.figures = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # Turn a selection into a file name safe key
+    def _key(self, selection):
+        return hashlib.sha256(repr(selection).encode()).hexdigest()
+
+    def get(self, selection):
+        key = self._key(selection)
+        with self.lock:
+            if key in self.figures:
+                self.figures.move_to_end(key)
+                self.hits += 1
+                return self.figures[key]
+
+        # Fall back to the copy on disk, if there is one
+        if self.cache_dir and os.path.exists(os.path.join(self.cache_dir, key + '.json')):
+            with open(os.path.join(self.cache_dir, key + '.png'), 'rb') as f:
+                image = f.read()
+            with open(os.path.join(self.cache_dir, key + '.json'), 'r') as f:
+                info = json.load(f)
+            self._store(key, image, info)
+            with self.lock:
+                self.hits += 1
+            return image, info
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, selection, image, info=None):
+        key = self._key(selection)
+        info = info or {}
+        self._store(key, image, info)
+
+        if self.cache_dir:
+            self._write_file(key + '.png', image)
+            # The info file is written last as it marks the figure as complete
+            self._write_file(key + '.json', json.dumps(info).encode())
+
+    # Write a file in the cache folder through a temporary file, so other sessions and processes reading the cache
+    # only ever see the old file or the complete new one
+    def _write_file(self, name, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.cache_dir, name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _store(self, key, image, info):
+        with self.lock:
+            if key in self.figures:
+                self.size -= len(self.figures.pop(key)[0])
+            if len(image) > self.max_bytes:
+                return
+            self.figures[key] = (image, info)
+            self.size += len(image)
+            while self.size > self.max_bytes:
+                _, (evicted_image, _) = self.figures.popitem(last=False)
+                self.size -= len(evicted_image)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.figures), 'size_mb': round(self.size / 1024**2, 2)}
+
+# Figure cache shared by every user of the website. Set RUBBERDUCKS_FIGURE_CACHE to a folder to keep figures on disk too.
+figure_cache = FigureCache(32 * 1024**2, os.environ.get('RUBBERDUCKS_FIGURE_CACHE'))
+
+# Render a matplotlib figure to PNG bytes the same way st.pyplot() does, then close it to free its memory
+def figure_png(fig, dpi=default_dpi):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    return buffer.getvalue()
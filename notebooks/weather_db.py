@@ -0,0 +1,300 @@
+# import necessary libraries
+import datetime
+import pandas as pd
+from sqlalchemy import create_engine, text, inspect, bindparam
+import weather_store as ws
+import perf
+
+# The eight daily weather variables we collect from the open-meteo API
+weather_variables = [
+    "temperature_2m_max",
+    "temperature_2m_min",
+    "temperature_2m_mean",
+    "daylight_duration",
+    "sunshine_duration",
+    "precipitation_sum",
+    "rain_sum",
+    "precipitation_hours",
+]
+
+# The hourly weather variables we collect from the open-meteo API for the hourly mode.
+# Any hourly variable the API offers can be added, as they are matched up with the responses by name.
+hourly_variables = [
+    "temperature_2m",
+    "relative_humidity_2m",
+    "precipitation",
+    "rain",
+    "cloud_cover",
+    "wind_speed_10m",
+]
+
+# An hour counts as wet when at least this much precipitation (mm) falls in it
+wet_hour_mm = 0.1
+
+# Hours of the day (local time) counted as commuting hours. Hourly precipitation is the total for the hour before
+# each timestamp, so 7-9am and 4-7pm are the hours ending at 8, 9, 17, 18 and 19.
+commute_hours = [8, 9, 17, 18, 19]
+
+# Rollup tables built from the hourly weather: one row per city and day, and one per city, year and hour of the day
+hourly_rollup_tables = {
+    'weather_hourly_daily': ['city', 'date'],
+    'weather_hour_of_day': ['city', 'year', 'hour'],
+}
+
+# The perception indicators we build from the Google NGRAMS data
+perception_variables = [
+    "rain_absolute_appearances",
+    "rain_relative_appearances",
+    "sun_absolute_appearances",
+    "sun_relative_appearances",
+    "wind_absolute_appearances",
+    "wind_relative_appearances",
+]
+
+# SQL expression for the year of each row in the weather table
+_year = "CAST(strftime('%Y', date) AS INTEGER)"
+
+# Rollup tables built from the daily weather table.
+# Each one maps to the SQL expressions for the first and last day of the period that a date falls in.
+rollup_tables = {
+    'weather_monthly': (
+        "date(date, 'start of month')",
+        "date(date, 'start of month', '+1 month', '-1 day')"
+    ),
+    'weather_yearly': (
+        "date(date, 'start of year')",
+        "date(date, 'start of year', '+1 year', '-1 day')"
+    ),
+    # 5 year periods end on years divisible by 5 (1936-1940, 1941-1945, ...) so they line up with our data starting in 1940
+    'weather_5yearly': (
+        f"printf('%04d-01-01', {_year} + (5 - {_year} % 5) % 5 - 4)",
+        f"printf('%04d-12-31', {_year} + (5 - {_year} % 5) % 5)"
+    ),
+}
+
+# SQL that aggregates the weather table into one of the rollup tables.
+# Sums and counts are kept so that periods can be combined with each other or with daily rows later on.
+def _rollup_select(table, where=''):
+    period_start, period_end = rollup_tables[table]
+    aggregates = ',\n'.join(
+        f"AVG({variable}) AS {variable}_mean, SUM({variable}) AS {variable}_sum, COUNT({variable}) AS {variable}_count"
+        for variable in weather_variables
+    )
+    return f"""
+        SELECT
+            city,
+            {period_start} AS period_start,
+            {period_end} AS period_end,
+            {aggregates}
+        FROM weather
+        {where}
+        GROUP BY city, period_start
+    """
+
+# Build the rollup tables holding the mean, sum and count of every variable for each city and period
+def build_rollups(engine):
+    with engine.begin() as conn:
+        for table in rollup_tables:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table};"))
+            conn.execute(text(f"CREATE TABLE {table} AS {_rollup_select(table)};"))
+            conn.execute(text(f"CREATE INDEX {table}_city_period ON {table} (city, period_start);"))
+
+# First and last day of the period that a date falls in for each of the rollup tables, matching the SQL above
+def period_bounds(table, day):
+    if table == 'weather_monthly':
+        start = day.replace(day=1)
+        end = (start + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+    elif table == 'weather_yearly':
+        start = datetime.date(day.year, 1, 1)
+        end = datetime.date(day.year, 12, 31)
+    else:
+        end_year = day.year + (5 - day.year % 5) % 5
+        start = datetime.date(end_year - 4, 1, 1)
+        end = datetime.date(end_year, 12, 31)
+    return start, end
+
+# Bring the rollup rows for the given cities up to date after new weather data has been added for them.
+# If `since` is given, only the periods from the one containing that date onwards are rebuilt.
+def refresh_rollups(engine, cities, since=None):
+    if not all(inspect(engine).has_table(table) for table in rollup_tables):
+        build_rollups(engine)
+        return
+
+    params = {'cities': list(cities)}
+    with engine.begin() as conn:
+        for table in rollup_tables:
+            where = "WHERE city IN :cities"
+            if since is not None:
+                params['cutoff'] = period_bounds(table, since)[0].isoformat()
+                delete_where = where + " AND period_start >= :cutoff"
+                where += " AND date >= :cutoff"
+            else:
+                delete_where = where
+
+            delete = text(f"DELETE FROM {table} {delete_where};")
+            insert = text(f"INSERT INTO {table} {_rollup_select(table, where)};")
+            conn.execute(delete.bindparams(bindparam('cities', expanding=True)), params)
+            conn.execute(insert.bindparams(bindparam('cities', expanding=True)), params)
+
+# Summarise hourly weather (from process_responses(..., resolution='hourly')) into the hourly rollup tables.
+# Sums and counts of every variable are kept, like the daily rollups, along with the number of hours and wet hours,
+# and for each day the number of wet hours during commuting hours.
+@perf.timed()
+def hourly_rollups(df, variables=hourly_variables):
+    if 'precipitation' not in df.columns:
+        raise ValueError("Hourly weather needs precipitation to count the wet hours")
+    times = pd.to_datetime(df['date'])
+    wet = df['precipitation'].to_numpy() >= wet_hour_mm
+    hourly_df = pd.DataFrame({
+        'city': df['city'].astype(str).to_numpy(),
+        'day': times.dt.normalize().to_numpy(),
+        'year': times.dt.year.to_numpy(),
+        'hour': times.dt.hour.to_numpy(),
+        'wet': wet,
+        'wet_commute': wet & times.dt.hour.isin(commute_hours).to_numpy(),
+    })
+    aggregates = {'hours': ('wet', 'size'), 'wet_hours': ('wet', 'sum')}
+    for variable in variables:
+        hourly_df[variable] = df[variable].to_numpy(dtype='float64')
+        aggregates[f'{variable}_sum'] = (variable, 'sum')
+        aggregates[f'{variable}_count'] = (variable, 'count')
+
+    daily_df = hourly_df.groupby(['city', 'day'], sort=True).agg(wet_commute_hours=('wet_commute', 'sum'), **aggregates).reset_index()
+    daily_df.insert(1, 'date', daily_df.pop('day').dt.strftime('%Y-%m-%d'))
+    hour_df = hourly_df.groupby(['city', 'year', 'hour'], sort=True).agg(**aggregates).reset_index()
+    return {'weather_hourly_daily': daily_df, 'weather_hour_of_day': hour_df}
+
+# Build the hourly rollup tables from the hourly weather store, one city at a time so only one city's hourly weather
+# is ever in memory. The hourly weather itself stays in the store. The indexes are built once every row is in.
+def build_hourly_rollups(engine, hourly_source=ws.hourly_store_path):
+    with engine.begin() as conn:
+        for table in hourly_rollup_tables:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table};"))
+
+    cities = ws.list_cities(hourly_source)
+    for city in cities:
+        for table, rollup_df in hourly_rollups(ws.read_weather_store(hourly_source, cities=[city])).items():
+            rollup_df.to_sql(table, engine, if_exists='append', index=False, chunksize=10000)
+
+    if cities:
+        with engine.begin() as conn:
+            for table, key in hourly_rollup_tables.items():
+                conn.execute(text(f"CREATE INDEX {table}_key ON {table} ({', '.join(key)});"))
+
+# Create the weather and perception tables with proper column types.
+# Dates are stored as ISO 'YYYY-MM-DD' text so they sort and compare correctly and still work with strftime,
+# and (city, date) is the primary key so every city and date range lookup can use the index.
+def create_schema(engine):
+    weather_columns = ',\n'.join(f"{variable} REAL" for variable in weather_variables)
+    perception_columns = ',\n'.join(f"{variable} REAL" for variable in perception_variables)
+
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS weather (
+                city TEXT NOT NULL,
+                date TEXT NOT NULL CHECK (date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'),
+                {weather_columns},
+                PRIMARY KEY (city, date)
+            ) WITHOUT ROWID;
+        """))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS perception (
+                year INTEGER PRIMARY KEY,
+                {perception_columns}
+            );
+        """))
+
+# Convert a column to floats, cleaning out any thousands separators if it was read in as text
+def _to_numeric(series):
+    if series.dtype == object:
+        series = series.astype(str).str.replace(',', '')
+    return pd.to_numeric(series, errors='coerce').astype('float64')
+
+# Convert a weather dataframe to the most compact layout pandas offers: float32 measurements, a categorical city
+# and dates stored as datetime64 values rather than Python date objects. This roughly halves the memory of the
+# measurements and removes a Python object per row for the city and date.
+@perf.timed()
+def compact_weather(df):
+    df = df.copy(deep=False)
+    for column in df.columns:
+        if column == 'city':
+            df[column] = df[column].astype('category')
+        elif column == 'date':
+            df[column] = pd.to_datetime(df[column]).astype('datetime64[s]')
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype('float32')
+    if isinstance(df.index, pd.DatetimeIndex):
+        df.index = df.index.astype('datetime64[s]')
+    return df
+
+# Check and convert the weather data to the types used by the database so this only happens once, when it is loaded
+@perf.timed()
+def validate_weather(df):
+    missing = [column for column in ['city', 'date'] + weather_variables if column not in df.columns]
+    if missing:
+        raise ValueError(f"Weather data is missing columns: {missing}")
+    if df['city'].isna().any():
+        raise ValueError("Weather data has rows without a city")
+
+    clean_df = pd.DataFrame({
+        'city': df['city'].astype(str),
+        # Raises an error if any of the dates can't be parsed
+        'date': pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d'),
+    })
+    for variable in weather_variables:
+        clean_df[variable] = _to_numeric(df[variable])
+
+    duplicates = clean_df.duplicated(subset=['city', 'date'])
+    if duplicates.any():
+        raise ValueError(f"Weather data has {duplicates.sum()} duplicated city and date rows")
+    return clean_df
+
+# Check and convert the perception data to the types used by the database
+@perf.timed()
+def validate_perception(df):
+    missing = [column for column in ['year'] + perception_variables if column not in df.columns]
+    if missing:
+        raise ValueError(f"Perception data is missing columns: {missing}")
+
+    clean_df = pd.DataFrame({'year': pd.to_numeric(df['year'], errors='raise').astype('int64')})
+    for variable in perception_variables:
+        clean_df[variable] = _to_numeric(df[variable])
+    return clean_df
+
+# Validate the weather data and add it to the weather table
+def load_weather(df, engine):
+    validate_weather(df).to_sql('weather', engine, if_exists='append', index=False, chunksize=10000)
+
+# The rows of a validated dataframe as tuples, ready for executemany.
+# NaN is stored as NULL by SQLite, so the values can be passed as they are.
+def row_tuples(df):
+    return zip(*(df[column].tolist() for column in df.columns))
+
+# Validate the weather data and insert it into the weather table using an open connection, replacing any rows
+# already stored for the same city and date. Nothing is committed, so it can be part of a bigger transaction.
+def insert_weather(df, conn):
+    clean_df = validate_weather(df)
+    columns = list(clean_df.columns)
+    insert = f"INSERT OR REPLACE INTO weather ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))});"
+    conn.exec_driver_sql(insert, list(row_tuples(clean_df)))
+
+# Validate the perception data and add it to the perception table
+def load_perception(df, engine):
+    validate_perception(df).to_sql('perception', engine, if_exists='append', index=False)
+
+# Read the weather data a piece at a time: one city at a time (in alphabetical order, the order of the weather
+# table's primary key) from the weather store, or `chunk_rows` rows at a time from a CSV file, so only one piece
+# is ever in memory
+def iter_weather_source(weather_source, chunk_rows=100000):
+    if weather_source.endswith('.csv'):
+        yield from pd.read_csv(weather_source, chunksize=chunk_rows)
+        return
+    for city in sorted(ws.list_cities(weather_source)):
+        yield ws.read_weather_store(weather_source, cities=[city])
+
+# Build rainy.db from scratch using the weather data (the columnar store or a CSV) and perception CSV created in NB01,
+# with the bulk loader in bulk_load.py. The hourly rollups are added from the hourly weather store in `hourly_source`, if given.
+def build_database(db_path, weather_source, perception_csv, hourly_source=None):
+    import bulk_load
+    bulk_load.bulk_load(db_path, weather_source, perception_csv, hourly_source)
+    return create_engine(f'sqlite:///{db_path}', echo=False)
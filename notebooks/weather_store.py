@@ -0,0 +1,143 @@
+# import necessary libraries
+import os
+import json
+import urllib.parse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Folder holding the columnar copy of the weather data, worked out from this file so it works from the notebooks and the website
+store_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'weather')
+
+# Folder holding the hourly weather, which is only ever kept in this format
+hourly_store_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'weather_hourly')
+
+# The store keeps one uncompressed Arrow IPC file per city with one record batch per year.
+# Uncompressed IPC files can be memory mapped, so reading only touches the years and columns that are asked for
+# and nothing has to be parsed. Measurements are stored as float32 and the city as a dictionary encoded column.
+# Daily data is stored with a date column and hourly data with a timestamp column (to the second), still named 'date'.
+
+# File holding the list of cities in the order they were written
+_manifest_name = '_cities.json'
+
+# Path of the file for a city, quoting any characters that can't go in a file name
+def _city_file(city, path):
+    return os.path.join(path, urllib.parse.quote(city, safe=' ') + '.arrow')
+
+# List the cities in the store in the order they were written
+def list_cities(path=store_path):
+    manifest = os.path.join(path, _manifest_name)
+    if not os.path.exists(manifest):
+        return []
+    with open(manifest, 'r') as f:
+        return json.load(f)
+
+# Write a single city's weather to its file, with one record batch for each year
+def _write_city(city, city_df, path, resolution):
+    city_df = city_df.sort_values('date')
+    dates = pd.to_datetime(city_df['date']).to_numpy()
+    if resolution == 'daily':
+        date_array = pa.array(dates.astype('datetime64[D]'), type=pa.date32())
+    else:
+        date_array = pa.array(dates.astype('datetime64[s]'), type=pa.timestamp('s'))
+
+    columns = {
+        'date': date_array,
+        'city': pa.DictionaryArray.from_arrays(pa.array(np.zeros(len(dates), dtype='int8')), pa.array([city])),
+    }
+    # Every other column is a measurement
+    for variable in city_df.columns.drop(['date', 'city']):
+        columns[variable] = pa.array(city_df[variable].to_numpy(dtype='float32'))
+    table = pa.table(columns)
+
+    # Find where each year starts so every year gets its own record batch
+    years = dates.astype('datetime64[Y]').astype(int) + 1970
+    starts = np.flatnonzero(np.diff(years)) + 1
+    bounds = list(zip(np.r_[0, starts], np.r_[starts, len(years)]))
+    batch_years = [int(years[start]) for start, _ in bounds]
+
+    schema = table.schema.with_metadata({'city': city, 'batch_years': json.dumps(batch_years)})
+    file = _city_file(city, path)
+
+    # Write to a temporary file first so readers never see a half written file
+    with pa.OSFile(file + '.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for start, end in bounds:
+                writer.write_table(table.slice(start, end - start))
+    os.replace(file + '.tmp', file)
+
+# Write weather data (like the output of process_response) to the store, replacing the files of any cities in it.
+# `resolution` is 'daily' or 'hourly', matching the data.
+def write_weather_store(df, path=store_path, resolution='daily'):
+    os.makedirs(path, exist_ok=True)
+    cities = list_cities(path)
+
+    for city, city_df in df.groupby('city', sort=False, observed=True):
+        city = str(city)
+        _write_city(city, city_df, path, resolution)
+        if city not in cities:
+            cities.append(city)
+
+    with open(os.path.join(path, _manifest_name), 'w') as f:
+        json.dump(cities, f)
+
+# Add new weather data to the store, keeping the new values for any dates that were already stored
+def append_weather_store(df, path=store_path, resolution='daily'):
+    existing_cities = list_cities(path)
+    frames = []
+    for city, city_df in df.groupby('city', sort=False, observed=True):
+        if str(city) in existing_cities:
+            stored_df = read_weather_store(path, cities=[str(city)])
+            city_df = pd.concat([stored_df, city_df.assign(date=pd.to_datetime(city_df['date']))], ignore_index=True)
+            city_df = city_df.drop_duplicates(subset='date', keep='last')
+        frames.append(city_df.assign(city=str(city)))
+
+    if frames:
+        write_weather_store(pd.concat(frames, ignore_index=True), path, resolution)
+
+# Read weather from the store as an Arrow table. Only the record batches for the years in the date range and
+# the requested columns are read, and the data stays memory mapped rather than being copied.
+def read_weather_table(path=store_path, cities=None, columns=None, start=None, end=None):
+    cities = list_cities(path) if cities is None else cities
+
+    tables = []
+    for city in cities:
+        reader = pa.ipc.open_file(pa.memory_map(_city_file(city, path)))
+        batch_years = json.loads(reader.schema.metadata[b'batch_years'])
+        batches = [
+            reader.get_batch(i) for i, year in enumerate(batch_years)
+            if (start is None or year >= start.year) and (end is None or year <= end.year)
+        ]
+        table = pa.Table.from_batches(batches, schema=reader.schema)
+        if columns is not None:
+            table = table.select(['date', 'city'] + columns)
+
+        # Trim the first and last years down to the exact dates (hourly timestamps are compared by their day)
+        dates = table['date'] if pa.types.is_date32(table['date'].type) else pc.cast(table['date'], pa.date32())
+        keep = pc.greater_equal(dates, pa.scalar(start, type=pa.date32())) if start is not None else None
+        if end is not None:
+            before_end = pc.less_equal(dates, pa.scalar(end, type=pa.date32()))
+            keep = before_end if keep is None else pc.and_(keep, before_end)
+        if keep is not None:
+            table = table.filter(keep)
+        tables.append(table.replace_schema_metadata(None))
+
+    if not tables:
+        return pa.table({'date': pa.array([], type=pa.date32())})
+    return pa.concat_tables(tables)
+
+# Read weather from the store as a pandas dataframe, with the city as a categorical column
+def read_weather_store(path=store_path, cities=None, columns=None, start=None, end=None):
+    table = read_weather_table(path, cities, columns, start, end)
+    return table.to_pandas(date_as_object=False)
+
+# Read the first few rows of the store, only touching the first year of the first city
+def head(n=20, path=store_path):
+    cities = list_cities(path)
+    if not cities:
+        return pd.DataFrame(columns=['date', 'city'])
+
+    reader = pa.ipc.open_file(pa.memory_map(_city_file(cities[0], path)))
+    batch = reader.get_batch(0).slice(0, n)
+    return pa.Table.from_batches([batch]).replace_schema_metadata(None).to_pandas(date_as_object=False)
@@ -0,0 +1,102 @@
+# import necessary libraries
+import os
+import json
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from wordcloud import WordCloud
+import custom_functions as cf
+
+# Folders for the pre-rendered word clouds on the website and for the ones rendered on demand
+images_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docs', 'images', 'wordclouds')
+cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'wordclouds')
+
+# File in the images folder recording the inputs each image was rendered from
+_manifest_name = '_manifest.json'
+
+# Count the words the same way WordCloud.generate() does, so the counts can be hashed before anything is drawn
+def word_frequencies(words):
+    return WordCloud().process_text(' '.join(words))
+
+# Hash everything that changes how a word cloud looks: the word counts, the colour scheme and the image size
+def cloud_hash(frequencies, width=800, height=400):
+    inputs = {
+        'frequencies': sorted(frequencies.items()),
+        'weather_words': sorted(cf.cloud_weather_words),
+        'colors': [cf.weather_word_color, cf.other_word_color],
+        'size': [width, height],
+    }
+    return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+# Draw one word cloud and save it as a PNG
+def render_wordcloud(frequencies, image_path, width=800, height=400):
+    wordcloud = WordCloud(width=width, height=height, background_color=None, color_func=cf.custom_color_func, mode="RGBA")
+    wordcloud.generate_from_frequencies(frequencies)
+    wordcloud.to_file(image_path)
+    return image_path
+
+def _read_manifest(out_dir):
+    manifest = os.path.join(out_dir, _manifest_name)
+    if not os.path.exists(manifest):
+        return {}
+    with open(manifest, 'r') as f:
+        return json.load(f)
+
+# Render the word clouds for every city in a process pool, skipping any whose inputs haven't changed since they were
+# last rendered. Returns whether each city was 'rendered', 'skipped' (unchanged) or 'empty' (no words to draw).
+def render_wordclouds(city_words, out_dir=images_path, width=800, height=400, max_workers=None):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = _read_manifest(out_dir)
+
+    status = {}
+    to_render = {}
+    for city, words in city_words.items():
+        frequencies = word_frequencies(words)
+        image_path = os.path.join(out_dir, f'{city}.png')
+        digest = cloud_hash(frequencies, width, height)
+        if not frequencies:
+            status[city] = 'empty'
+        elif manifest.get(city) == digest and os.path.exists(image_path):
+            status[city] = 'skipped'
+        else:
+            to_render[city] = (frequencies, image_path, digest)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {city: executor.submit(render_wordcloud, frequencies, image_path, width, height)
+                   for city, (frequencies, image_path, _) in to_render.items()}
+        for city, future in futures.items():
+            future.result()
+            manifest[city] = to_render[city][2]
+            status[city] = 'rendered'
+
+    with open(os.path.join(out_dir, _manifest_name), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return status
+
+# Get the word cloud image for a city, rendering it only if there isn't already one for the same inputs.
+# Pre-rendered images are used when they are up to date (or were made before we kept a manifest) and anything else
+# is rendered once into a cache folder named after the hash of its inputs. Returns None if there are no words to draw.
+def get_wordcloud(city, words, images_dir=images_path, cache_dir=cache_path, width=800, height=400):
+    frequencies = word_frequencies(words)
+    if not frequencies:
+        return None
+    digest = cloud_hash(frequencies, width, height)
+
+    image_path = os.path.join(images_dir, f'{city}.png')
+    manifest = _read_manifest(images_dir)
+    if os.path.exists(image_path) and manifest.get(city, digest) == digest:
+        return image_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_path = os.path.join(cache_dir, f'{digest}.png')
+    if not os.path.exists(cached_path):
+        # Each render gets its own temporary file, so sessions drawing the same cloud at once don't overwrite each other
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.png')
+        os.close(fd)
+        try:
+            render_wordcloud(frequencies, tmp_path, width, height)
+            os.replace(tmp_path, cached_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return cached_path